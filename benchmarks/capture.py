@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Measures the overhead of capturing screenshots with skald, using a fake
+WebDriver instead of a browser.
+
+Every capture creates a screenshot with one document annotating a number of
+elements, and saves it. The time spent waiting for the simulated browser
+and writing files is reported separately from the time spent in skald
+itself.
+
+Run from the repository root with ``python benchmarks/capture.py``.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from skald import definitions
+from skald.definitions import Screenshot, Document, save
+from skald.testing import FakeWebDriver
+
+class Timer:
+    """Accumulates the time spent in a function."""
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+def run(args, folder):
+    config_path = os.path.join(folder, "skald.json")
+    with open(config_path, "w") as config_file:
+        json.dump({"folder": os.path.join(folder, "skald"),
+            "content_addressed": args.content_addressed}, config_file)
+
+    driver = FakeWebDriver(width=args.width, height=args.height,
+            latency=args.latency)
+    elements = driver.create_elements(args.elements)
+    driver.get_screenshot_as_png()
+    driver.calls.clear()
+
+    # Time file I/O by wrapping the functions writing files. Screenshots
+    # are streamed into a file while they are taken, so the writes and
+    # hashing inside take_screenshot count as file I/O, and the rest of it
+    # as capturing.
+    timers = dict((name, Timer(getattr(definitions, name))) for name in
+            ("write_if_changed", "write_screenshot", "take_screenshot"))
+    stream = Timer(definitions.HashingFile.write)
+    def write(self, data):
+        return stream(self, data)
+    for name, timer in timers.items():
+        setattr(definitions, name, timer)
+    definitions.HashingFile.write = write
+    try:
+        start = time.perf_counter()
+        for i in range(args.captures):
+            screenshot = Screenshot("page%d" % i, "flow%d" % (i % 10))
+            document = Document("document", crop=("*", "*", "*", "*"))
+            document.add_element(*elements, tooltip="Tooltip")
+            screenshot.add_document(document)
+            save(screenshot, driver, config_path)
+        total = time.perf_counter() - start
+    finally:
+        for name, timer in timers.items():
+            setattr(definitions, name, timer.function)
+        definitions.HashingFile.write = stream.function
+    io_seconds = (timers["write_if_changed"].seconds
+            + timers["write_screenshot"].seconds
+            - timers["take_screenshot"].seconds + stream.seconds)
+    return total, driver.round_trips, io_seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--captures", type=int, default=1000)
+    parser.add_argument("--elements", type=int, default=20,
+            help="Number of elements annotated in each capture.")
+    parser.add_argument("--latency", type=float, default=0.0,
+            help="Seconds each call to the browser takes.")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--content-addressed", action="store_true")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        total, round_trips, io_seconds = run(args, folder)
+    finally:
+        shutil.rmtree(folder)
+
+    waiting = round_trips * args.latency
+    captures = args.captures
+    print("captures             %8d" % captures)
+    print("per capture          %8.3f ms" % (total / captures * 1000))
+    print("  round trips        %8.1f" % (round_trips / captures))
+    print("  waiting on browser %8.3f ms" % (waiting / captures * 1000))
+    print("  file I/O           %8.3f ms" % (io_seconds / captures * 1000))
+    print("  skald overhead     %8.3f ms" %
+            ((total - waiting - io_seconds) / captures * 1000))
+
+if __name__ == "__main__":
+    main()
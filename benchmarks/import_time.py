@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Measures the time it takes to import the capture and rendering sides of
+skald in a fresh interpreter.
+
+Run from the repository root with ``python benchmarks/import_time.py``.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+MODULES = ["skald.definitions", "skald.webdoc"]
+
+def time_import(module, runs):
+    """Imports ``module`` in ``runs`` fresh interpreters.
+
+    :return: The best wall time in seconds, with the interpreter start up
+        time subtracted.
+    """
+    def run(code):
+        best = float("inf")
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, "-c", code])
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    baseline = run("pass")
+    return run("import %s" % module) - baseline
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        seconds = time_import(module, args.runs)
+        print("%-20s %8.1f ms" % (module, seconds * 1000))
+
+if __name__ == "__main__":
+    main()
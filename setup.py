@@ -13,10 +13,10 @@ setup(
     ],
     keywords="documentation",
     packages=find_packages(),
-    install_requires=["Pillow"],
+    install_requires=["Pillow>=8.0"],
     entry_points={
         "console_scripts": [
-            "skald=skald.main:main"
+            "skald=skald.main:run"
         ],
     },
 )
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import io
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Size of the compressed data collected before it is written as an IDAT
+# chunk.
+IDAT_SIZE = 1 << 16
+
+PAGE_SCRIPT = """
+return {
+    "height": Math.max(document.documentElement.scrollHeight,
+        document.body ? document.body.scrollHeight : 0),
+    "viewport": window.innerHeight,
+    "x": window.pageXOffset,
+    "y": window.pageYOffset
+};
+"""
+SCROLL_SCRIPT = """
+window.scrollTo(arguments[0], arguments[1]);
+return window.pageYOffset;
+"""
+
+class PNGWriter:
+    """Writes a PNG image row by row, so that the whole image never has to
+    be held in memory.
+    """
+    def __init__(self, file, width, height, mode="RGB"):
+        """
+
+        :param file: A writable binary file object.
+        :param width: Width of the image in pixels.
+        :param height: Height of the image in pixels.
+        :param mode: Either ``RGB`` or ``RGBA``.
+        """
+        self.file = file
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows = 0
+        self._compressor = zlib.compressobj()
+        self._buffer = []
+        self._buffered = 0
+
+        color_type = {"RGB": 2, "RGBA": 6}[mode]
+        self.file.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8,
+            color_type, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        checksum = zlib.crc32(data, zlib.crc32(chunk_type))
+        self.file.write(struct.pack(">I", checksum & 0xffffffff))
+
+    def _write_compressed(self, data, flush=False):
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        if self._buffered >= IDAT_SIZE or (flush and self._buffered):
+            self._write_chunk(b"IDAT", b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def write_rows(self, data):
+        """Writes complete rows of raw pixel data, in the mode of the
+        image.
+        """
+        stride = self.width * len(self.mode)
+        for start in range(0, len(data), stride):
+            # Each row is prefixed by its filter type, which is none.
+            self._write_compressed(self._compressor.compress(b"\0"))
+            self._write_compressed(
+                    self._compressor.compress(data[start:start + stride]))
+            self.rows += 1
+
+    def close(self):
+        """Finishes the image. Missing rows are filled with zeros."""
+        missing = self.height - self.rows
+        if missing > 0:
+            self.write_rows(bytes(self.width * len(self.mode) * missing))
+        self._write_compressed(self._compressor.flush(), flush=True)
+        self._write_chunk(b"IEND", b"")
+
+def capture_full_page(driver, file):
+    """Captures the whole page by scrolling through it, taking a screenshot
+    of the viewport at each step and stitching them together.
+
+    Each tile is written to the PNG as soon as it is captured, so memory use
+    does not grow with the length of the page.
+
+    Element locations given by Selenium are relative to the top of the page,
+    so they match the stitched image without being adjusted.
+
+    :param driver: A :py:class:`~selenium.webdriver.remote.webdriver.WebDriver`.
+    :param file: A writable binary file object to write the PNG to.
+    :return: The ``(width, height)`` of the stitched image.
+    """
+    from PIL import Image
+
+    page = driver.execute_script(PAGE_SCRIPT)
+    viewport = page["viewport"]
+    height = page["height"]
+    writer = None
+    written = 0
+    offset = 0
+    try:
+        while written < height:
+            top = driver.execute_script(SCROLL_SCRIPT, 0,
+                    min(offset, max(height - viewport, 0)))
+            tile = Image.open(io.BytesIO(driver.get_screenshot_as_png()))
+            # Screenshots can have more pixels than the viewport, e.g. on
+            # high density displays.
+            ratio = tile.height / viewport
+            if writer is None:
+                mode = "RGBA" if "A" in tile.mode else "RGB"
+                writer = PNGWriter(file, tile.width,
+                        int(round(height * ratio)), mode)
+            if tile.mode != writer.mode:
+                tile = tile.convert(writer.mode)
+
+            # Rounded in page coordinates, so that the rows of all tiles add
+            # up to the height of the image.
+            last = min(top + viewport, height)
+            first = int(round(written * ratio)) - int(round(top * ratio))
+            rows = int(round(last * ratio)) - int(round(written * ratio))
+            rows = min(rows, tile.height - first)
+            if rows <= 0:
+                # The page can not be scrolled any further.
+                break
+            tile = tile.crop((0, first, writer.width, first + rows))
+            writer.write_rows(tile.tobytes())
+            written = last
+            offset = last
+    finally:
+        driver.execute_script(SCROLL_SCRIPT, page["x"], page["y"])
+    if writer is None:
+        raise ValueError("Could not capture an empty page")
+    writer.close()
+    return writer.width, writer.height
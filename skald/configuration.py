@@ -3,8 +3,6 @@ import json
 import os
 from collections import namedtuple
 
-from PIL import ImageFont
-
 Color = namedtuple("Color", ["red", "green", "blue", "alpha"])
 
 def hex_to_tuple(color):
@@ -39,7 +37,7 @@ def get_color(color, default):
     """
     if color is None:
         return default
-    elif isinstance(color, basestring):
+    elif isinstance(color, str):
         return hex_to_tuple(color)
     else:
         if len(color) == 3:
@@ -51,15 +49,25 @@ class Penalties:
     """Penalties are used to calculate how good a tooltip position is.
 
     """
-    def __init__(self, move=1):
+    def __init__(self, move=1, content=0):
         """
 
         :param move: Used to adjust the penalty when a tooltip needs to be moved
             from it's initially calculated position, such as moving it from
             outside of bounds to the inside. This is multiplied with the number
             of pixels the tooltip is moved.
+        :param content: Used to adjust the penalty for covering busy parts of
+            the screenshot that are not declared as elements, such as text
+            and charts. This is multiplied with the edge strength, from 0 to
+            1, summed over every pixel the tooltip covers. See
+            :py:class:`~skald.content.ContentMap`. Requires NumPy when not
+            ``0``. The content map needs the whole screenshot, so it is
+            always decoded in full, even for documents cropping a part of
+            it, and the map takes about 16 bytes per pixel while it is
+            built.
         """
         self.move = move
+        self.content = content
 
 class Font:
     """Defines the font to be used when writing text in the documents.
@@ -79,13 +87,22 @@ class Font:
         self.path = path
         self.size = size
         self.color = get_color(color, Color(255, 255, 255, 255))
+        self._font = None
 
     def get_font(self):
-        """Get a :py:class:`~PIL.ImageFont` instance representing this font."""
-        if self.path is None:
-            return ImageFont.load_default()
-        else:
-            return ImageFont.truetype(self.path, self.size)
+        """Get a :py:class:`~PIL.ImageFont` instance representing this font.
+
+        The font is only loaded the first time, and then reused.
+        """
+        if self._font is None:
+            # Imported here so that capturing screenshots does not require
+            # loading Pillow.
+            from PIL import ImageFont
+            if self.path is None:
+                self._font = ImageFont.load_default()
+            else:
+                self._font = ImageFont.truetype(self.path, self.size)
+        return self._font
 
 class Tooltip:
     """Defines style of tooltips."""
@@ -106,9 +123,44 @@ class Tooltip:
         self.margin = margin
         self.color = get_color(color, Color(50, 50, 185, 255))
 
+class Variant:
+    """Defines an output variant of each document, such as a high resolution
+    or a thumbnail version.
+
+    The variant with the largest ``scale`` is rendered at the native
+    resolution of the screenshot, while the other variants are reduced from
+    it.
+    """
+    def __init__(self, suffix="", scale=1, max_width=None, format="PNG"):
+        """
+
+        :param suffix: Appended to the document name to create the file name
+            of the variant, e.g. ``@2x`` or ``-thumbnail``.
+        :param scale: The scale of the variant relative to the other variants.
+        :param max_width: If given, the variant is reduced further until it is
+            no wider than this many pixels.
+        :param format: The image format to save the variant as, as understood
+            by Pillow, e.g. ``PNG``, ``JPEG`` or ``WEBP``.
+        """
+        self.suffix = suffix
+        self.scale = scale
+        self.max_width = max_width
+        self.format = format.upper()
+
+    @property
+    def extension(self):
+        """The file extension used for the format of this variant."""
+        if self.format == "JPEG":
+            return "jpg"
+        return self.format.lower()
+
 class Configuration:
     def __init__(self, font=None, tooltip=None, penalties=None,
-            folder="skald"):
+            folder="skald", variants=None, content_addressed=False,
+            cache_folder=None, memory_budget=None, workers=None,
+            full_page=False, output_folder=None, name=None, spool=False,
+            prefetch=None, layout_snapshot=False, keep_placement=False,
+            pixel_cache_size=2048):
         """Create the base configuration class.
 
         All ``None`` parameters will be populated with their classes defaults.
@@ -121,6 +173,51 @@ class Configuration:
             :py:class:`~skald.configuration.Penalties` defining how different
             adjustments made to tooltips affect the penalty of the position.
         :param folder: Path to put screenshots, documents and metadata.
+        :param variants: A list of :py:class:`~skald.configuration.Variant`
+            defining the output files created for each document. Defaults to
+            a single PNG at the resolution of the screenshot.
+        :param content_addressed: If ``True``, screenshots are stored once per
+            unique image, named by the hash of their content, and referenced
+            from the metadata. Identical screenshots are then only stored and
+            decoded once.
+        :param cache_folder: Path to a folder where data is cached between
+            runs, such as decoded screenshots. Nothing is cached between runs
+            if ``None``.
+        :param memory_budget: If given, screenshots are rendered concurrently
+            as long as their estimated memory use stays within this many
+            megabytes. Screenshots are rendered one at a time if ``None``.
+        :param workers: The maximum number of screenshots rendered at once
+            when ``memory_budget`` is given.
+        :param full_page: If ``True``, screenshots capture the whole page by
+            scrolling through it and stitching the viewport together, rather
+            than what the driver captures, which is often just the viewport.
+        :param output_folder: Path to put documents in. Defaults to
+            ``folder``, putting each document next to its screenshot.
+        :param name: The name of the profile this configuration was read
+            from, if any. See
+            :py:func:`~skald.configuration.read_configurations`.
+        :param spool: If ``True``, every saved screenshot is also registered
+            in a spool folder, so that ``skald watch`` can render it as soon
+            as it is saved instead of scanning the whole folder for changes.
+            Rendering every screenshot with ``skald`` claims the pending
+            registrations, unless only a shard is rendered.
+        :param prefetch: If given, up to this many screenshots are read,
+            placed and decoded ahead in a background thread while the
+            current one is drawn, and documents are encoded and written in
+            another. Screenshots are not prepared ahead if ``memory_budget``
+            is given.
+        :param layout_snapshot: If ``True``, the position, size and
+            visibility of every element with an id, a name or a
+            ``data-skald`` attribute is saved with each screenshot, so that
+            documents can reference elements by selector without a browser.
+        :param keep_placement: If ``True``, the placement of each document's
+            tooltips is stored in ``cache_folder``, and the next run keeps
+            tooltips where they were as long as that is still valid, so
+            documents do not change more than needed between runs. Requires
+            ``cache_folder``.
+        :param pixel_cache_size: The maximum number of megabytes of decoded
+            screenshots kept in ``cache_folder``. The least recently used are
+            removed when it is exceeded. No limit if ``None``.
         """
 
         if font is None:
@@ -133,6 +230,23 @@ class Configuration:
             penalties = Penalties()
         self.penalties = penalties
         self.folder = folder
+        if variants is None:
+            variants = [Variant()]
+        self.variants = variants
+        self.content_addressed = content_addressed
+        self.cache_folder = cache_folder
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.full_page = full_page
+        if output_folder is None:
+            output_folder = folder
+        self.output_folder = output_folder
+        self.name = name
+        self.spool = spool
+        self.prefetch = prefetch
+        self.layout_snapshot = layout_snapshot
+        self.keep_placement = keep_placement
+        self.pixel_cache_size = pixel_cache_size
 
     @classmethod
     def from_dict(cls, dictionary):
@@ -145,9 +259,35 @@ class Configuration:
         if "tooltip" in dictionary:
             dictionary["tooltip"] = Tooltip(**dictionary.get("tooltip"))
         if "penalties" in dictionary:
-            dictionary["penalties"] = Punishments(**dictionary.get("penalties"))
+            dictionary["penalties"] = Penalties(**dictionary.get("penalties"))
+        if "variants" in dictionary:
+            dictionary["variants"] = [Variant(**variant)
+                    for variant in dictionary.get("variants")]
         return cls(**dictionary)
 
+def merge_dicts(base, overrides):
+    """Recursively merges ``overrides`` into a copy of ``base``."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_dicts(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def get_configuration_path(path=None):
+    """Gets the path of the configuration file to read.
+
+    See :py:func:`~skald.configuration.read_configuration` for how ``path``
+    is interpreted. The returned file does not necessarily exist.
+    """
+    if path is None:
+        path = os.getcwd()
+
+    if os.path.isdir(path):
+        path = os.path.join(path, "skald.json")
+    return path
+
 def read_configuration(path=None):
     """Reads skald configuration.
 
@@ -158,16 +298,46 @@ def read_configuration(path=None):
     If a configuration file is found, it will be used to update
     `DEFAULT_CONFIG`.
 
+    If the file defines profiles, the first profile is returned, see
+    :py:func:`~skald.configuration.read_configurations`.
     """
-    if path is None:
-        path = os.getcwd()
+    return read_configurations(path)[0]
 
-    if os.path.isdir(path):
-        path = os.path.join(path, "skald.json")
+def read_configurations(path=None):
+    """Reads skald configuration with profiles.
+
+    A configuration file can define several profiles, such as a light and a
+    dark theme, under ``profiles``. Each profile maps a name to settings
+    overriding the rest of the file, merged recursively, so a profile only
+    needs to give what differs. Unless a profile sets ``output_folder``,
+    its documents are put in a folder named after the profile inside the
+    output folder of the file.
+
+    See :py:func:`~skald.configuration.read_configuration` for how ``path``
+    is interpreted.
+
+    :return: A list with a :py:class:`~skald.configuration.Configuration`
+        for each profile, or only the configuration itself if there are no
+        profiles.
+    """
+    path = get_configuration_path(path)
+
+    if not os.path.exists(path):
+        return [Configuration()]
 
-    if os.path.exists(path):
-        with open(path, "r") as config_file:
-            read_config = json.load(config_file)
-            return Configuration.from_dict(read_config)
+    with open(path, "r") as config_file:
+        read_config = json.load(config_file)
+    profiles = read_config.pop("profiles", None)
+    if not profiles:
+        return [Configuration.from_dict(read_config)]
 
-    return Configuration()
+    configurations = []
+    output_folder = read_config.get("output_folder",
+            read_config.get("folder", "skald"))
+    for name, overrides in sorted(profiles.items()):
+        profile = merge_dicts(read_config, overrides)
+        if "output_folder" not in overrides:
+            profile["output_folder"] = os.path.join(output_folder, name)
+        profile["name"] = name
+        configurations.append(Configuration.from_dict(profile))
+    return configurations
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Measures how busy the content of a screenshot is, so tooltips can avoid
+covering dense content that is not declared as elements, such as charts
+and text.
+
+Requires NumPy.
+"""
+
+class ContentMap:
+    """A summed-area table of the edge strength of a screenshot.
+
+    The edge strength of each pixel is the sum of the absolute differences
+    in brightness to the pixel above and to the left of it, from 0 to 1.
+    The table holds the sum of every pixel above and to the left of each
+    position, so the sum over any rectangle is found with four lookups.
+    """
+    def __init__(self, table):
+        """
+
+        :param table: A NumPy array of shape ``(height + 1, width + 1)``,
+            where ``table[y, x]`` is the sum of the edge strength of every
+            pixel above ``y`` and to the left of ``x``.
+        """
+        self.table = table
+        self.height = table.shape[0] - 1
+        self.width = table.shape[1] - 1
+
+    @classmethod
+    def from_image(cls, img):
+        """Creates the content map of a :py:class:`~PIL.Image.Image`."""
+        import numpy
+
+        gray = numpy.asarray(img.convert("L"), dtype=numpy.int16)
+        edges = numpy.zeros(gray.shape, dtype=numpy.int16)
+        edges[:, 1:] += numpy.abs(numpy.diff(gray, axis=1))
+        edges[1:, :] += numpy.abs(numpy.diff(gray, axis=0))
+        numpy.minimum(edges, 255, out=edges)
+
+        table = numpy.zeros((gray.shape[0] + 1, gray.shape[1] + 1),
+                dtype=numpy.int64)
+        numpy.cumsum(edges, axis=0, out=table[1:, 1:])
+        numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+        return cls(table)
+
+    def get_busyness(self, rectangle):
+        """Gets the summed edge strength of the pixels inside a
+        :py:class:`~skald.geometry.Rectangle`.
+
+        The parts of the rectangle outside of the image count as empty.
+        """
+        left = min(max(int(rectangle.left), 0), self.width)
+        top = min(max(int(rectangle.top), 0), self.height)
+        right = min(max(int(rectangle.right), left), self.width)
+        bottom = min(max(int(rectangle.bottom), top), self.height)
+        table = self.table
+        total = (table[bottom, right] - table[top, right]
+                - table[bottom, left] + table[top, left])
+        return float(total) / 255
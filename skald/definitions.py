@@ -1,16 +1,73 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import json
 import re
+import time
+import uuid
+import hashlib
+import tempfile
+from collections import namedtuple
 from enum import Enum
 
 from .geometry import Size, Point, Rectangle
 
 from .configuration import read_configuration
 
+OBJECTS_FOLDER = "objects"
+SPOOL_FOLDER = "spool"
+
+SaveResult = namedtuple("SaveResult", ["image_written", "metadata_written"])
+
+# Collects the position, size and visibility of every element with an id, a
+# name or a data-skald attribute, keyed by a selector for each. Positions
+# are relative to the top of the page, as element locations in Selenium.
+LAYOUT_SCRIPT = """
+var layout = {};
+var nodes = document.querySelectorAll("[id], [name], [data-skald]");
+var scrollX = window.pageXOffset, scrollY = window.pageYOffset;
+for (var i = 0; i < nodes.length; i++) {
+    var node = nodes[i];
+    var rect = node.getBoundingClientRect();
+    var style = window.getComputedStyle(node);
+    var entry = {
+        "x": rect.left + scrollX,
+        "y": rect.top + scrollY,
+        "width": rect.width,
+        "height": rect.height,
+        "visible": rect.width > 0 && rect.height > 0 &&
+            style.visibility !== "hidden" && style.display !== "none"
+    };
+    var selectors = [];
+    if (node.id) {
+        selectors.push("#" + node.id);
+    }
+    if (node.getAttribute("name")) {
+        selectors.push("[name=" + node.getAttribute("name") + "]");
+    }
+    if (node.hasAttribute("data-skald")) {
+        selectors.push("[data-skald=" + node.getAttribute("data-skald") + "]");
+    }
+    for (var j = 0; j < selectors.length; j++) {
+        if (!(selectors[j] in layout)) {
+            layout[selectors[j]] = entry;
+        }
+    }
+}
+return layout;
+"""
+
 Position = Enum("Position", "left over right under")
 Alignment = Enum("Alignment", "center top bottom left right")
 
+def get_object_path(image_hash):
+    """Gets the path of a content addressed screenshot, relative to the
+    screenshot folder.
+
+    :param image_hash: The SHA-256 hex digest of the PNG file.
+    """
+    return os.path.join(OBJECTS_FOLDER, image_hash[:2], "%s.png" % image_hash)
+
 def get_positions(positions):
     """Converts positions from string representation to enum.
 
@@ -73,7 +130,7 @@ class Tooltip:
 class Element:
     """Represents a element on the page."""
     def __init__(self, element=None, location=None, size=None,
-            overwrite_penalty="inf"):
+            overwrite_penalty="inf", selector=None):
         """
 
         :param element: A
@@ -82,6 +139,11 @@ class Element:
         :param overwrite_penalty: The penalty assignet to a tooltip which
             overwrites this element. The value will be parsed as a
             :py:obj:`float`.
+        :param selector: Instead of a location and size, the selector of the
+            element in the layout snapshot of the screenshot, such as
+            ``#id``, ``[name=value]`` or ``[data-skald=value]``. The element
+            is located when the screenshot is loaded, see
+            :py:meth:`~skald.definitions.Screenshot.resolve_elements`.
         """
         if element is not None:
             self.location = Point(x=element.location["x"], y=element.location["y"])
@@ -90,6 +152,7 @@ class Element:
             self.location = location
             self.size = size
         self.overwrite_penalty = float(overwrite_penalty)
+        self.selector = selector
         self.tooltips = []
 
     def add_tooltip(self, *tooltips):
@@ -137,8 +200,9 @@ class Document:
         """Add elements to this document.
 
         :param elements: Elements to be added to the document, can either be a
-            :py:class:`~selenium.webdriver.remote.webelement.WebElement` or a
-            :py:class:`~skald.definitions.Element`.
+            :py:class:`~selenium.webdriver.remote.webelement.WebElement`, a
+            :py:class:`~skald.definitions.Element`, or a selector in the
+            layout snapshot of the screenshot as a string.
         :param tooltip: Tooltip to be used for ``elements``. Passed directly to
             :py:meth:`~skald.definitions.Element.add_tooltip`, so argument
             should follow the same format.
@@ -152,7 +216,10 @@ class Document:
                     element.add_tooltip(tooltip)
                 self.elements.append(element)
             else:
-                element_rep = Element(element)
+                if isinstance(element, str):
+                    element_rep = Element(selector=element)
+                else:
+                    element_rep = Element(element)
                 if tooltip is not None:
                     element_rep.add_tooltip(tooltip)
                 self.elements.append(element_rep)
@@ -177,18 +244,49 @@ class Screenshot:
         self.name = name
         self.documents = []
         self.path = path
+        self.image_hash = None
+        self.layout = None
 
-    def add_document(self, document):
-        """Add a document to the screenshot.
+    def add_document(self, *documents):
+        """Add documents to the screenshot.
         
-        :param document: A :py:class:`~skald.definitions.Document` defining a
+        :param documents: A :py:class:`~skald.definitions.Document` defining a
             document to be created from this screenshot.
         """
-        self.documents.append(document)
+        self.documents.extend(documents)
+
+    def resolve_elements(self):
+        """Locates every element given by a selector in the layout snapshot.
+
+        :raises ValueError: If an element is not in the layout snapshot, or
+            is not visible.
+        """
+        for document in self.documents:
+            for element in document.elements:
+                if element.selector is None or element.location is not None:
+                    continue
+                entry = (self.layout or {}).get(element.selector)
+                if entry is None:
+                    raise ValueError("Element '%s' of document '%s' is not in "
+                            "the layout snapshot of screenshot '%s'" %
+                            (element.selector, document.name, self.name))
+                if not entry["visible"]:
+                    raise ValueError("Element '%s' of document '%s' is not "
+                            "visible in screenshot '%s'" %
+                            (element.selector, document.name, self.name))
+                element.location = Point(x=entry["x"], y=entry["y"])
+                element.size = Size(width=entry["width"],
+                        height=entry["height"])
 
     @property
     def image_path(self):
-        """The path of the actual imagefile itself."""
+        """The path of the actual imagefile itself.
+
+        If the screenshot is content addressed, this is the path of the
+        shared image given by :py:func:`~skald.definitions.get_object_path`.
+        """
+        if self.image_hash is not None:
+            return get_object_path(self.image_hash)
         return os.path.join(self.path, "%s.png" % self.name)
 
     @property
@@ -206,7 +304,9 @@ class ScreenshotEncoder(json.JSONEncoder):
             return {
                 "name": obj.name,
                 "path": obj.path,
+                "image_hash": obj.image_hash,
                 "documents": [self.default(document) for document in obj.documents],
+                "layout": obj.layout,
             }
         elif isinstance(obj, Document):
             return {
@@ -216,6 +316,7 @@ class ScreenshotEncoder(json.JSONEncoder):
             }
         elif isinstance(obj, Element):
             return {
+                "selector": obj.selector,
                 "location": obj.location,
                 "size": obj.size,
                 "overwrite_penalty": obj.overwrite_penalty,
@@ -238,7 +339,10 @@ class ScreenshotDecoder(json.JSONDecoder):
     def decode(self, string):
         obj = super().decode(string)
         screenshot = Screenshot(obj["name"], obj["path"])
+        screenshot.image_hash = obj.get("image_hash")
+        screenshot.layout = obj.get("layout")
         screenshot.add_document(*self.get_documents(obj["documents"]))
+        screenshot.resolve_elements()
         return screenshot
 
     def get_documents(self, documents):
@@ -255,13 +359,18 @@ class ScreenshotDecoder(json.JSONDecoder):
     def get_elements(self, elements):
         ret = []
         for element in elements:
-            location = Point(*element["location"])
-            size = Size(*element["size"])
-            overwrite_penalty = element.get("overwrite_penalty")
+            location = None
+            if element.get("location") is not None:
+                location = Point(*element["location"])
+            size = None
+            if element.get("size") is not None:
+                size = Size(*element["size"])
+            overwrite_penalty = element.get("overwrite_penalty", "inf")
             obj = Element(
                 location=location,
                 size=size,
-                overwrite_penalty=overwrite_penalty
+                overwrite_penalty=overwrite_penalty,
+                selector=element.get("selector"),
             )
             obj.add_tooltip(*self.get_tooltips(element["tooltips"]))
             ret.append(obj)
@@ -280,17 +389,194 @@ class ScreenshotDecoder(json.JSONDecoder):
             ret.append(obj)
         return ret
 
+def take_screenshot(driver, config, file=None):
+    """Takes a screenshot of the current page.
+
+    :param driver: A
+        :py:class:`~selenium.webdriver.remote.webdriver.WebDriver`.
+    :param config: If ``full_page`` is set, the whole page is captured by
+        :py:func:`~skald.capture.capture_full_page`. Otherwise only what the
+        driver captures, usually the viewport.
+    :param file: An optional writable binary file object to write the PNG
+        to. A full page screenshot is streamed into it as it is captured.
+    :return: The PNG as :py:obj:`bytes` if ``file`` is not given.
+    """
+    if file is None:
+        data = io.BytesIO()
+        take_screenshot(driver, config, data)
+        return data.getvalue()
+    if config.full_page:
+        from .capture import capture_full_page
+        capture_full_page(driver, file)
+    else:
+        file.write(driver.get_screenshot_as_png())
+
+def write_atomic(path, data):
+    """Writes ``data`` to a temporary file next to ``path`` and renames it
+    to ``path``, so that readers never see a partially written file.
+
+    :param data: The content as :py:obj:`bytes`, or a list of
+        :py:obj:`bytes` written one after the other, which avoids joining
+        large content in memory.
+    """
+    if isinstance(data, bytes):
+        data = [data]
+    folder, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(dir=folder or ".", prefix="." + name,
+            suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            for chunk in data:
+                temp_file.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def hash_file(path):
+    """Gets the SHA-256 hex digest of the file at ``path``."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def has_content(path, data):
+    """Checks whether the file at ``path`` holds exactly ``data``, reading it
+    a block at a time.
+    """
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        view = memoryview(data)
+        with open(path, "rb") as existing:
+            offset = 0
+            for block in iter(lambda: existing.read(1 << 20), b""):
+                if view[offset:offset + len(block)] != block:
+                    return False
+                offset += len(block)
+        return True
+    except OSError:
+        return False
+
+def write_if_changed(path, data):
+    """Writes ``data`` to ``path``, unless the file already has exactly the
+    same content.
+
+    Leaving unchanged files untouched keeps their modification time, so that
+    tools looking for changes do not treat them as changed.
+
+    :param data: The content as :py:obj:`bytes`.
+    :return: ``True`` if the file was written.
+    """
+    if has_content(path, data):
+        return False
+    write_atomic(path, data)
+    return True
+
+class HashingFile:
+    """Wraps a writable binary file, hashing everything written to it."""
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def write_screenshot(driver, config, screenshot):
+    """Streams a screenshot of the current page into a temporary file while
+    hashing it, and moves it into place unless an identical image is already
+    stored. The whole PNG is never held in memory.
+
+    With ``content_addressed`` set in ``config``, the image is stored under
+    its hash, which is set on ``screenshot``, unless an identical image is
+    already stored.
+
+    :return: ``True`` if the image was written.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=config.folder, prefix=".screenshot",
+            suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            file = HashingFile(temp_file)
+            take_screenshot(driver, config, file)
+        image_hash = file.hexdigest()
+
+        if config.content_addressed:
+            screenshot.image_hash = image_hash
+        image_path = os.path.join(config.folder, screenshot.image_path)
+        if os.path.exists(image_path) and (config.content_addressed
+                or hash_file(image_path) == image_hash):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        os.replace(temp_path, image_path)
+        return True
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def register_capture(screenshot, folder):
+    """Registers a saved screenshot in the spool folder, from where a
+    renderer can claim it with :py:func:`~skald.webdoc.claim_screenshots`.
+
+    Every registration is written to a file of its own, so concurrent
+    processes never need to lock a shared file.
+
+    :param folder: The screenshot folder.
+    """
+    spool = os.path.join(folder, SPOOL_FOLDER)
+    os.makedirs(spool, exist_ok=True)
+    name = "%d-%d-%s.json" % (time.time() * 1000000, os.getpid(),
+            uuid.uuid4().hex)
+    entry = json.dumps({"metadata": screenshot.meta_path})
+    write_atomic(os.path.join(spool, name), entry.encode("utf-8"))
+
 def save(screenshot, driver, config_path=None):
+    """Takes the screenshot and saves it along with its metadata.
+
+    Files that already have the same content are not rewritten. Files are
+    written atomically, so several processes can save into the same folder
+    while it is being rendered.
+
+    :param screenshot: The :py:class:`~skald.definitions.Screenshot` to
+        save.
+    :param driver: The
+        :py:class:`~selenium.webdriver.remote.webdriver.WebDriver` to take
+        the screenshot with.
+    :param config_path: Path to the configuration, see
+        :py:func:`~skald.configuration.read_configuration`.
+    :return: A :py:class:`~skald.definitions.SaveResult` telling which files
+        were written.
+    """
     config = read_configuration(config_path)
-    folder = os.path.join(config.folder, screenshot.path)
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+    os.makedirs(os.path.join(config.folder, screenshot.path), exist_ok=True)
+
+    if config.layout_snapshot:
+        # Taken before the screenshot, as capturing a full page scrolls it.
+        screenshot.layout = driver.execute_script(LAYOUT_SCRIPT)
+
+    image_written = write_screenshot(driver, config, screenshot)
 
-    image_path = os.path.join(config.folder, screenshot.image_path)
     meta_path = os.path.join(config.folder, screenshot.meta_path)
-    driver.save_screenshot(image_path)
-    with open(meta_path, "w") as json_file:
-        json.dump(screenshot, json_file, cls=ScreenshotEncoder)
+    metadata = json.dumps(screenshot, cls=ScreenshotEncoder)
+    # The metadata is written last, so that once it exists the image it
+    # references is complete.
+    metadata_written = write_if_changed(meta_path, metadata.encode("utf-8"))
+    if config.spool and (image_written or metadata_written):
+        register_capture(screenshot, config.folder)
+    return SaveResult(image_written=image_written,
+            metadata_written=metadata_written)
 
 def load(path):
     with open(path, "r") as json_file:
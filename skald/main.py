@@ -1,7 +1,156 @@
 # -*- coding: utf-8 -*-
-from .configuration import read_configuration
-from .webdoc import process_screenshots, get_screenshots
+import argparse
+
+from .configuration import read_configurations
+from .webdoc import (process_screenshots, process_profiles, get_screenshots,
+        shard_screenshots, claim_screenshots)
+from .watch import Watcher
+from .server import RenderServer
+from .sinks import ArchiveSink, SpriteSink, PrefixSink
+
+def parse_shard(value):
+    """Parses a shard given as ``INDEX/COUNT``."""
+    try:
+        index, count = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "Shard must be given as INDEX/COUNT, got '%s'" % value)
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+                "Shard index must be between 1 and COUNT, got '%s'" % value)
+    return index, count
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="skald",
+            description="Create documented screenshots from skald captures.")
+    parser.add_argument("command", nargs="?", default="render",
+            choices=("render", "watch", "serve"),
+            help="Either render all screenshots once, watch for changes "
+                "and re-render them, or serve render jobs over HTTP. "
+                "Defaults to render.")
+    parser.add_argument("-c", "--config", default=None,
+            help="Path to the configuration file, or a directory containing "
+                "a skald.json file.")
+    parser.add_argument("--interval", type=float, default=0.5,
+            help="Seconds between each check for changes in watch mode.")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+            metavar="INDEX/COUNT",
+            help="Only render shard INDEX of COUNT, where INDEX starts at "
+                "1. Every shard can run on a separate machine.")
+    parser.add_argument("--shard-by", choices=("path", "cost"),
+            default="path",
+            help="Distribute screenshots between shards by a hash of their "
+                "path, or balanced by their estimated rendering cost.")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--archive", default=None, metavar="PATH",
+            help="Write all documents into a single zip or tar archive, "
+                "chosen by the extension of PATH, instead of next to each "
+                "screenshot.")
+    output.add_argument("--sprites", action="store_true",
+            help="Pack the documents of each folder into a sprite sheet, "
+                "with a JSON and a CSS map of where each document is.")
+    parser.add_argument("--host", default="127.0.0.1",
+            help="Address to listen on in serve mode.")
+    parser.add_argument("--port", type=int, default=8765,
+            help="Port to listen on in serve mode.")
+    parser.add_argument("--socket", default=None, metavar="PATH",
+            help="Listen on a Unix socket at PATH instead of a port in "
+                "serve mode.")
+    parser.add_argument("--processes", type=int, default=None,
+            help="Number of worker processes in serve mode. Defaults to "
+                "the number of CPUs.")
+    return parser
+
+def render(config_path=None, shard=None, shard_by="path", archive=None,
+        sprites=False):
+    """Renders every screenshot once, with every configuration profile.
+
+    :param config_path: The path to the configuration, see
+        :py:func:`~skald.configuration.read_configurations`.
+    :param shard: An optional 2-tuple of the index, starting at 1, and the
+        count of shards, to only render one shard.
+    :param shard_by: Either ``path`` or ``cost``, see
+        :py:func:`~skald.webdoc.shard_screenshots`.
+    :param archive: An optional path of a zip or tar archive to write every
+        document into.
+    :param sprites: If ``True``, the documents of each folder are packed
+        into sprite sheets.
+    :raises ValueError: If a shard is combined with an archive or sprite
+        sheets, which each shard would write partially at the same paths.
+    """
+    if shard is not None and (archive is not None or sprites):
+        raise ValueError("A shard cannot be written to an archive or sprite "
+                "sheets, as every shard would write them at the same paths")
+    configs = read_configurations(config_path)
+    config = configs[0]
+    if config.spool and shard is None:
+        # Everything is rendered, so pending registrations are obsolete.
+        # Claimed before scanning, so later registrations are kept.
+        claim_screenshots(config.folder)
+    screenshots = get_screenshots(config.folder)
+    if shard is not None:
+        index, count = shard
+        screenshots = shard_screenshots(screenshots, index, count,
+                config.folder, weighted=shard_by == "cost")
+    if len(configs) > 1:
+        archive_sink = None
+        sinks = None
+        if archive is not None:
+            archive_sink = ArchiveSink(archive)
+            sinks = [PrefixSink(archive_sink, config.name)
+                    for config in configs]
+        elif sprites:
+            sinks = [SpriteSink(config.output_folder) for config in configs]
+        try:
+            process_profiles(screenshots, configs, sinks)
+        finally:
+            if archive_sink is not None:
+                archive_sink.close()
+        return
+
+    sink = None
+    if archive is not None:
+        sink = ArchiveSink(archive)
+    elif sprites:
+        sink = SpriteSink(config.output_folder)
+    process_screenshots(screenshots, config, sink=sink)
 
 def main(config_path=None):
-    config = read_configuration(config_path)
-    process_screenshots(get_screenshots(config.folder), config)
+    """Renders every screenshot once. Command line arguments are not read,
+    see :py:func:`~skald.main.run` for the ``skald`` command.
+    """
+    render(config_path)
+
+def run(argv=None):
+    """The ``skald`` command.
+
+    :param argv: The command line arguments, defaulting to
+        :py:data:`sys.argv`.
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    config_path = args.config
+    if args.shard is not None and (args.archive is not None or args.sprites):
+        parser.error("--shard cannot be combined with --archive or "
+                "--sprites")
+
+    if args.command == "watch":
+        try:
+            Watcher(config_path, interval=args.interval).watch()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == "serve":
+        server = RenderServer(config_path, host=args.host, port=args.port,
+                socket=args.socket, processes=args.processes)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        return
+
+    render(config_path, shard=args.shard, shard_by=args.shard_by,
+            archive=args.archive, sprites=args.sprites)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import struct
+
+from PIL import Image
+
+from .definitions import hash_file, write_atomic
+
+MAGIC = b"SKPX"
+VERSION = 1
+# Magic, version, raw mode, width and height, padded to 32 bytes so that the
+# pixel data is aligned.
+HEADER = struct.Struct("<4sB7sII12x")
+
+# Modes stored as is, and the raw mode their pixels are stored in. Pillow
+# stores RGB images with four bytes per pixel, so they are stored as RGBX to
+# be mapped without copying.
+RAW_MODES = {
+    "L": "L",
+    "RGB": "RGBX",
+    "RGBA": "RGBA",
+}
+CHANNELS = {"L": 1, "RGBX": 4, "RGBA": 4}
+
+class PixelCache:
+    """Caches decoded screenshots on disk as raw pixels.
+
+    Cached images are memory mapped and wrapped as Pillow images or NumPy
+    arrays without copying, so rendering the same screenshot again skips
+    decoding the PNG entirely. Entries are keyed by the hash of the PNG file,
+    so a changed screenshot is never read from a stale entry.
+
+    Entries of changed screenshots are never used again, so when the cache
+    grows beyond ``max_size``, the least recently used entries are removed.
+    """
+    def __init__(self, folder, max_size=None):
+        """
+
+        :param folder: The folder to store cached images in.
+        :param max_size: The maximum number of bytes of entries to keep, or
+            ``None`` for no limit.
+        """
+        self.folder = folder
+        self.max_size = max_size
+
+    def get_entry_path(self, digest):
+        """Gets the path of the cache entry for a PNG with hash ``digest``."""
+        return os.path.join(self.folder, digest[:2], "%s.raw" % digest)
+
+    def store(self, path, entry):
+        """Decodes the image at ``path`` and stores its pixels in ``entry``."""
+        img = Image.open(path)
+        if img.mode not in RAW_MODES:
+            if "A" in img.mode or "transparency" in img.info:
+                img = img.convert("RGBA")
+            else:
+                img = img.convert("RGB")
+        raw_mode = RAW_MODES[img.mode]
+
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Written atomically, so that concurrent runs never map a partially
+        # written entry.
+        write_atomic(entry, [HEADER.pack(MAGIC, VERSION,
+            raw_mode.encode("ascii"), img.width, img.height),
+            img.tobytes("raw", raw_mode)])
+        self.prune(keep=entry)
+
+    def prune(self, keep=None):
+        """Removes the least recently used entries until the rest take at
+        most ``max_size`` bytes.
+
+        :param keep: The path of an entry that is never removed.
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                if not name.endswith(".raw"):
+                    continue
+                entry = os.path.join(root, name)
+                try:
+                    stat = os.stat(entry)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry, stat.st_size))
+
+        total = sum(size for mtime, entry, size in entries)
+        for mtime, entry, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry == keep:
+                continue
+            try:
+                # Runs that already mapped the entry keep their mapping.
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def map(self, path):
+        """Memory maps the cache entry for the image at ``path``, creating it
+        if it does not exist.
+
+        :return: A 4-tuple of the memory map, the raw mode, the size as
+            ``(width, height)`` and the offset of the pixel data.
+        """
+        entry = self.get_entry_path(hash_file(path))
+        if os.path.exists(entry):
+            # Marks the entry as recently used.
+            os.utime(entry)
+        else:
+            self.store(path, entry)
+        with open(entry, "rb") as f:
+            memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, raw_mode, width, height = HEADER.unpack_from(memory)
+        if magic != MAGIC or version != VERSION:
+            memory.close()
+            os.remove(entry)
+            return self.map(path)
+        raw_mode = raw_mode.rstrip(b"\0").decode("ascii")
+        return memory, raw_mode, (width, height), HEADER.size
+
+    def get(self, path):
+        """Gets the image at ``path`` as a read only
+        :py:class:`~PIL.Image.Image` backed by the memory mapped cache entry.
+
+        RGB images are returned in ``RGBX`` mode, as that is how they are
+        mapped.
+        """
+        memory, raw_mode, size, offset = self.map(path)
+        return Image.frombuffer(raw_mode, size, memoryview(memory)[offset:],
+                "raw", raw_mode, 0, 1)
+
+    def get_array(self, path):
+        """Gets the image at ``path`` as a read only NumPy array of shape
+        ``(height, width, channels)`` backed by the memory mapped cache entry.
+        """
+        import numpy
+
+        memory, raw_mode, size, offset = self.map(path)
+        channels = CHANNELS[raw_mode]
+        array = numpy.frombuffer(memory, dtype=numpy.uint8, offset=offset,
+                count=size[0] * size[1] * channels)
+        return array.reshape((size[1], size[0], channels))
@@ -120,7 +120,7 @@ def align_left_position(anchor, size, alignment, margin):
     return Point(x=x, y=y)
 
 def _init_box_position(anchor, size, bounds, margin, position, alignment,
-        avoid, penalties):
+        avoid, penalties, content=None):
     allowed_alignments = {
         Position.left: (Alignment.top, Alignment.bottom, Alignment.center),
         Position.right: (Alignment.top, Alignment.bottom, Alignment.center),
@@ -159,11 +159,21 @@ def _init_box_position(anchor, size, bounds, margin, position, alignment,
     for element in avoid:
         if rectangle in element.rectangle:
             penalty += element.overwrite_penalty
+    if content is not None and penalties.content:
+        penalty += content.get_busyness(rectangle) * penalties.content
     if penalty == float("inf"):
         return None
     return Choice(rectangle=rectangle, penalty=penalty)
 
-def get_box_position(element, tooltip, size, bounds, margin, avoid, penalties):
+def get_box_position(element, tooltip, size, bounds, margin, avoid, penalties,
+        content=None):
+    """Finds every allowed position of a tooltip, and the penalty of each.
+
+    :param content: An optional :py:class:`~skald.content.ContentMap` of the
+        screenshot, used to penalise covering busy content.
+    :return: A list of :py:class:`~skald.positioning.Choice`, sorted by
+        penalty.
+    """
     positions = tuple(Position)
     if tooltip.positions:
         positions = tooltip.positions
@@ -176,9 +186,96 @@ def get_box_position(element, tooltip, size, bounds, margin, avoid, penalties):
         for alignment in alignments:
             choice = _init_box_position(anchor=element.rectangle, size=size,
                     bounds=bounds, margin=margin, alignment=alignment,
-                    avoid=avoid, penalties=penalties, position=position)
+                    avoid=avoid, penalties=penalties, position=position,
+                    content=content)
             if choice is not None:
                 choices.append(choice)
 
     choices.sort(key=lambda x: x.penalty)
     return choices
+
+def get_conflicts(choice_lists):
+    """Numbers every choice and finds which choices overlap each other.
+
+    Choices are numbered consecutively, one list after the other. The
+    conflicts of each choice are stored as a bitset in a Python
+    :py:obj:`int`, where bit ``n`` is set if the choice overlaps choice
+    ``n`` of another list, so that checking a choice against everything
+    already chosen is a single AND operation.
+
+    :param choice_lists: A list with a list of
+        :py:class:`~skald.positioning.Choice` for each tooltip.
+    :return: A 2-tuple of a list with the number of the first choice of each
+        list, and a list with the conflict bitset of each choice.
+    """
+    offsets = []
+    rectangles = []
+    owners = []
+    for i, choices in enumerate(choice_lists):
+        offsets.append(len(rectangles))
+        for choice in choices:
+            rectangles.append(choice.rectangle)
+            owners.append(i)
+
+    conflicts = [0] * len(rectangles)
+    for a in range(len(rectangles)):
+        for b in range(a + 1, len(rectangles)):
+            if owners[a] != owners[b] and rectangles[a] in rectangles[b]:
+                conflicts[a] |= 1 << b
+                conflicts[b] |= 1 << a
+    return offsets, conflicts
+
+def solve_placement(choice_lists):
+    """Selects one choice from each list, so that no selected choices
+    overlap and the sum of their penalties is as low as possible.
+
+    The search is a depth first branch and bound, where the choices still
+    available to each tooltip are tracked as a bitset. Branches where any
+    remaining tooltip has no choice left, or which can not beat the best
+    combination found, are abandoned. Among combinations with the same
+    penalty, the one with the earliest choices is selected.
+
+    :param choice_lists: A list with a list of
+        :py:class:`~skald.positioning.Choice` for each tooltip.
+    :return: A list with the selected :py:class:`~skald.positioning.Choice`
+        for each tooltip, or ``None`` if every combination overlaps.
+    """
+    offsets, conflicts = get_conflicts(choice_lists)
+    masks = [((1 << len(choices)) - 1) << offset
+            for choices, offset in zip(choice_lists, offsets)]
+    orders = [sorted(range(len(choices)), key=lambda i: choices[i].penalty)
+            for choices in choice_lists]
+
+    # The lowest penalty the remaining tooltips can possibly add.
+    remaining = [0] * (len(choice_lists) + 1)
+    for depth in range(len(choice_lists) - 1, -1, -1):
+        penalties = [choice.penalty for choice in choice_lists[depth]]
+        remaining[depth] = remaining[depth + 1] + min(penalties or [0])
+
+    best = [float("inf"), None]
+    selected = []
+
+    def search(depth, excluded, penalty):
+        if depth == len(choice_lists):
+            best[0] = penalty
+            best[1] = list(selected)
+            return
+        choices = choice_lists[depth]
+        for index in orders[depth]:
+            number = offsets[depth] + index
+            if excluded >> number & 1:
+                continue
+            total = penalty + choices[index].penalty
+            if total + remaining[depth + 1] >= best[0]:
+                # Choices are visited by increasing penalty.
+                break
+            excluding = excluded | conflicts[number]
+            if any(not mask & ~excluding for mask in masks[depth + 1:]):
+                continue
+            selected.append(choices[index])
+            search(depth + 1, excluding, total)
+            selected.pop()
+
+    if all(choice_lists):
+        search(0, 0, 0)
+    return best[1]
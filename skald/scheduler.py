@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# Bytes per pixel of a decoded image, as Pillow stores RGB images with four
+# bytes per pixel.
+BYTES_PER_PIXEL = 4
+# A content map is built from a grayscale copy and two int16 arrays, into an
+# int64 summed-area table, with int16 temporaries along the way.
+CONTENT_MAP_BYTES_PER_PIXEL = 16
+
+def estimate_memory(image_path, documents=1, content=False):
+    """Estimates the peak memory used when rendering the documents of a
+    screenshot, as a decoded copy of the screenshot plus a copy for each
+    rendered document, which are all held until they are written.
+
+    Only the header of the image is read.
+
+    :param documents: The number of documents of the screenshot.
+    :param content: If ``True``, a :py:class:`~skald.content.ContentMap` of
+        the screenshot is built as well.
+    :return: The estimated number of bytes.
+    """
+    with Image.open(image_path) as img:
+        pixels = img.width * img.height
+    total = (1 + documents) * pixels * BYTES_PER_PIXEL
+    if content:
+        total += pixels * CONTENT_MAP_BYTES_PER_PIXEL
+    return total
+
+class MemoryScheduler:
+    """Runs jobs concurrently while the sum of their estimated memory use
+    stays within a budget.
+
+    A job is only started when it fits within what is left of the budget.
+    A job larger than the whole budget is run alone, so large screenshots
+    are rendered one at a time while small ones run concurrently.
+    """
+    def __init__(self, budget, workers=None):
+        """
+
+        :param budget: The memory budget, in bytes.
+        :param workers: The maximum number of jobs running at once. Defaults
+            to the default of :py:class:`~concurrent.futures.ThreadPoolExecutor`.
+        """
+        self.budget = budget
+        self.workers = workers
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def _release(self, cost):
+        with self._lock:
+            self.used -= cost
+
+    def _try_acquire(self, cost):
+        with self._lock:
+            if self.used > 0 and self.used + cost > self.budget:
+                return False
+            self.used += cost
+            return True
+
+    def iterate(self, jobs):
+        """Runs ``jobs``, waiting for enough of the budget to be available
+        before starting each of them, and yields their return values as they
+        finish.
+
+        :param jobs: An iterable of 3-tuples of the estimated memory use in
+            bytes, a function and a tuple of arguments to call it with.
+        :return: A generator of the return values of the jobs, in the order
+            they finish. If a job raises an exception, it is raised once
+            the job is reached. The memory of a job is only given back to
+            the budget once the consumer asks for the next value, since the
+            return value is held until then.
+        """
+        finished = queue.Queue()
+        pending = 0
+
+        def take():
+            future, cost = finished.get()
+            try:
+                yield future.result()
+            finally:
+                self._release(cost)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for cost, function, args in jobs:
+                while not self._try_acquire(cost):
+                    # Memory is released as finished jobs are consumed.
+                    pending -= 1
+                    yield from take()
+                future = executor.submit(function, *args)
+                future.add_done_callback(lambda future, cost=cost:
+                        finished.put((future, cost)))
+                pending += 1
+            while pending:
+                pending -= 1
+                yield from take()
+
+    def run(self, jobs):
+        """Runs ``jobs`` like :py:meth:`~skald.scheduler.MemoryScheduler.iterate`,
+        and waits for all of them to finish.
+
+        As every return value is kept, only the memory used while running
+        the jobs is limited, not the memory of their return values.
+
+        :return: A list of the return values of the jobs, in the same order
+            as ``jobs``.
+        """
+        def call(index, function, args):
+            return index, function(*args)
+
+        indexed = ((cost, call, (index, function, args))
+                for index, (cost, function, args) in enumerate(jobs))
+        results = sorted(self.iterate(indexed), key=lambda x: x[0])
+        return [result for index, result in results]
+
+def prefetch(function, items, depth=1):
+    """Calls ``function`` on each item in a background thread, staying at
+    most ``depth`` results ahead of the consumer.
+
+    Lets the next items be read and decoded, which mostly releases the GIL,
+    while the current one is being processed.
+
+    :return: A generator of the results, in the order of ``items``.
+        Exceptions raised by ``function`` are raised from the generator.
+    """
+    results = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(result):
+        while not stopped.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, function(item))):
+                    return
+        except BaseException as e:
+            put((False, e))
+            return
+        put(None)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            succeeded, value = result
+            if not succeeded:
+                raise value
+            yield value
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import base64
+import socketserver
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .configuration import read_configurations
+from .definitions import load, ScreenshotDecoder
+from .sinks import DirectorySink, MemorySink
+from .webdoc import (ImageCache, get_output_name, get_patch_cache,
+        create_document)
+
+def check_inside(path, folder):
+    """Checks that a path from a job is inside a folder, so that jobs can
+    only read screenshots and write documents where skald is configured to.
+
+    :raises ValueError: If the path leaves the folder.
+    """
+    path = os.path.realpath(path)
+    folder = os.path.realpath(folder)
+    if os.path.commonpath([path, folder]) != folder:
+        raise ValueError("'%s' is outside of '%s'" % (path, folder))
+    return path
+
+class Worker:
+    """Renders jobs inside a worker process of a
+    :py:class:`~skald.server.RenderServer`.
+
+    The configuration, fonts, rendered tooltips and recently decoded
+    screenshots are kept between jobs.
+    """
+    def __init__(self, config_path=None, images=8):
+        """
+
+        :param config_path: The path to the configuration, see
+            :py:func:`~skald.configuration.read_configurations`.
+        :param images: Number of decoded screenshots to keep in memory.
+        """
+        self.configs = read_configurations(config_path)
+        self.config = self.configs[0]
+        self.images = ImageCache(size=images)
+        self.patches = get_patch_cache(self.config)
+
+    def get_screenshot(self, job):
+        """Gets the screenshot metadata and the path of its image for a job.
+
+        :raises ValueError: If the metadata or the image is outside of the
+            screenshot folder.
+        """
+        if "metadata" in job:
+            metadata = load(check_inside(job["metadata"], self.config.folder))
+        elif "screenshot" in job:
+            screenshot = job["screenshot"]
+            if not isinstance(screenshot, str):
+                screenshot = json.dumps(screenshot)
+            metadata = ScreenshotDecoder().decode(screenshot)
+        else:
+            raise ValueError("A job needs either 'metadata' or 'screenshot'")
+        image = job.get("image")
+        if image is None:
+            image = os.path.join(self.config.folder, metadata.image_path)
+        return metadata, check_inside(image, self.config.folder)
+
+    def get_configuration(self, job):
+        """Gets the configuration of the profile named by the job.
+
+        :raises ValueError: If the configuration has profiles and the job
+            does not name one of them.
+        """
+        if len(self.configs) == 1 and job.get("profile") is None:
+            return self.config
+        names = [config.name for config in self.configs]
+        for config in self.configs:
+            if config.name == job.get("profile"):
+                return config
+        raise ValueError("A job must give a 'profile', one of: %s" %
+                ", ".join(names))
+
+    def render(self, job):
+        """Renders the documents of a single job.
+
+        :param job: A dictionary with either ``metadata``, the path to the
+            JSON metadata of a screenshot, or ``screenshot``, the metadata
+            itself, and optionally:
+
+            * ``image``: The path to the screenshot. Required unless it can
+              be found from the metadata.
+            * ``documents``: The names of the documents to render. Defaults
+              to every document of the screenshot.
+            * ``output``: Either ``files`` to write the documents to the
+              output folder and return their paths, or ``bytes`` to return
+              the encoded documents in base64.
+            * ``profile``: The name of the profile to render with. Required
+              if the configuration defines profiles.
+        :return: A dictionary with ``documents``, mapping the name of each
+            written variant to its path or its base64 encoded content.
+        """
+        config = self.get_configuration(job)
+        metadata, image = self.get_screenshot(job)
+        names = job.get("documents")
+        output = job.get("output", "files")
+        if output == "bytes":
+            sink = MemorySink()
+        elif output == "files":
+            sink = DirectorySink(config.output_folder)
+        else:
+            raise ValueError("Unknown output '%s'" % output)
+
+        base_image = self.images.get(image)
+        written = []
+        for document in metadata.documents:
+            if names is not None and document.name not in names:
+                continue
+            name = get_output_name(metadata.meta_path, document.name)
+            check_inside(os.path.join(config.output_folder, name),
+                    config.output_folder)
+            img = create_document(base_image, document, config,
+                    os.path.join(config.output_folder, name), self.patches)
+            written.extend(sink.write(name, img, config))
+        sink.close()
+
+        if output == "bytes":
+            return {"documents": dict((name,
+                base64.b64encode(data).decode("ascii"))
+                for name, data in sink.documents.items())}
+        return {"documents": dict((name,
+            os.path.abspath(os.path.join(config.output_folder, name)))
+            for name in written)}
+
+_worker = None
+
+def init_worker(config_path, images):
+    global _worker
+    _worker = Worker(config_path, images)
+
+def run_job(job):
+    """Renders a job in a worker process, returning errors instead of
+    raising them so that one failing job does not fail a whole batch.
+    """
+    try:
+        return _worker.render(job)
+    except Exception as e:
+        return {"error": "%s: %s" % (type(e).__name__, e)}
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """Accepts render jobs as JSON posted to ``/render``.
+
+    The body is either a single job or a list of jobs, see
+    :py:meth:`~skald.server.Worker.render`. A list of jobs is spread over
+    the worker processes, and answered with a list of results in the same
+    order.
+
+    Only requests with a JSON content type and without an ``Origin`` header
+    are accepted, so that web pages open in a browser on the same machine
+    cannot post jobs.
+    """
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/render":
+            self.send_error(404)
+            return
+        if self.headers.get("Origin") is not None:
+            self.send_json(403, {"error": "Cross-origin requests are not "
+                "accepted"})
+            return
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            self.send_json(415, {"error": "Jobs must be posted as "
+                "application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            jobs = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            self.send_json(400, {"error": "Invalid request: %s" % e})
+            return
+
+        if isinstance(jobs, list):
+            result = self.server.pool.map(run_job, jobs)
+        else:
+            result = self.server.pool.apply(run_job, (jobs,))
+        self.send_json(200, result)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+class RenderServer:
+    """Keeps a pool of warm worker processes rendering jobs received over
+    HTTP, on either a localhost port or a Unix socket.
+
+    Clients such as test workers and documentation tools then avoid starting
+    an interpreter, importing skald and loading fonts for every render.
+    """
+    def __init__(self, config_path=None, host="127.0.0.1", port=8765,
+            socket=None, processes=None, images=8):
+        """
+
+        :param config_path: The path to the configuration, see
+            :py:func:`~skald.configuration.read_configuration`.
+        :param host: The address to listen on.
+        :param port: The port to listen on. ``0`` picks a free port.
+        :param socket: Path of a Unix socket to listen on instead of a port.
+        :param processes: Number of worker processes. Defaults to the number
+            of CPUs.
+        :param images: Number of decoded screenshots each worker keeps in
+            memory.
+        """
+        self.pool = multiprocessing.Pool(processes, initializer=init_worker,
+                initargs=(config_path, images))
+        if socket is not None:
+            self.httpd = UnixHTTPServer(socket, RenderRequestHandler)
+        else:
+            self.httpd = ThreadingHTTPServer((host, port),
+                    RenderRequestHandler)
+        self.httpd.pool = self.pool
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def serve_forever(self):
+        print("Serving on", self.address)
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Stops serving and terminates the worker processes."""
+        self.httpd.shutdown()
+        self.close()
+
+    def close(self):
+        self.httpd.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
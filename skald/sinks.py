@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import json
+import time
+import queue
+import tarfile
+import zipfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+def get_variant_file(output, variant):
+    """Gets the path of the file a variant of a document is saved to.
+
+    :param output: The path of the document as given by
+        :py:func:`~skald.webdoc.get_output_file`.
+    :param variant: The :py:class:`~skald.configuration.Variant` to get the
+        path for.
+    """
+    base, _ = os.path.splitext(output)
+    return "%s%s.%s" % (base, variant.suffix, variant.extension)
+
+def reduce_image(img, size):
+    """Reduces an image to the given size.
+
+    Integer factors are reduced using :py:meth:`~PIL.Image.Image.reduce`,
+    which is considerably faster than resampling, and only what remains of a
+    fractional factor is resampled.
+    """
+    if size == img.size:
+        return img
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+def get_variant_size(size, variant, max_scale):
+    """Gets the size of a variant of a document rendered with ``size``."""
+    factor = variant.scale / max_scale
+    width = max(1, int(round(size[0] * factor)))
+    height = max(1, int(round(size[1] * factor)))
+    if variant.max_width is not None and width > variant.max_width:
+        height = max(1, int(round(height * variant.max_width / width)))
+        width = variant.max_width
+    return (width, height)
+
+def iter_variants(img, variants):
+    """Creates every variant of a rendered document.
+
+    Variants are created from largest to smallest, each reduced from the
+    smallest already created image that is at least as large, so that the
+    image rendered at the highest resolution is only drawn once.
+
+    :param variants: A list of :py:class:`~skald.configuration.Variant`.
+    :return: A generator of 2-tuples of the variant and its image.
+    """
+    max_scale = max(variant.scale for variant in variants)
+    sized = [(get_variant_size(img.size, variant, max_scale), variant)
+            for variant in variants]
+    sized.sort(key=lambda x: x[0], reverse=True)
+
+    sources = [img]
+    for size, variant in sized:
+        source = min([s for s in sources if s.width >= size[0] and
+                s.height >= size[1]], key=lambda s: s.width)
+        reduced = reduce_image(source, size)
+        sources.append(reduced)
+        if variant.format == "JPEG" and reduced.mode != "RGB":
+            reduced = reduced.convert("RGB")
+        yield variant, reduced
+
+def encode_image(img, format):
+    """Encodes an image in ``format`` and returns the :py:obj:`bytes`."""
+    data = io.BytesIO()
+    img.save(data, format=format)
+    return data.getvalue()
+
+def save_variants(img, output, config):
+    """Saves every variant of a rendered document defined in ``config``.
+
+    See :py:func:`~skald.sinks.iter_variants` for how variants are created.
+
+    :return: A list of the paths written.
+    """
+    paths = []
+    for variant, reduced in iter_variants(img, config.variants):
+        path = get_variant_file(output, variant)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        print("Saving to file", path)
+        reduced.save(path, format=variant.format)
+        paths.append(path)
+    return paths
+
+class Sink:
+    """Receives rendered documents and writes every variant of them
+    somewhere.
+
+    Sub-classes implement :py:meth:`~skald.sinks.Sink.write_file`.
+    """
+    def write(self, name, img, config):
+        """Writes every variant of a rendered document.
+
+        :param name: The path of the document, relative to the screenshot
+            folder, see :py:func:`~skald.webdoc.get_output_name`.
+        :param img: The rendered :py:class:`~PIL.Image.Image`.
+        :return: A list of the names written.
+        """
+        names = []
+        for variant, reduced in iter_variants(img, config.variants):
+            variant_name = get_variant_file(name, variant)
+            self.write_file(variant_name, reduced, variant.format)
+            names.append(variant_name)
+        return names
+
+    def write_file(self, name, img, format):
+        """Writes a single encoded image."""
+        raise NotImplementedError()
+
+    def close(self):
+        """Finishes writing. Called once every document is written."""
+        pass
+
+class ThreadedSink(Sink):
+    """Encodes and writes documents through another sink in a background
+    thread, so that the next document can be drawn meanwhile.
+
+    Pillow releases the GIL while compressing, so encoding overlaps with
+    drawing even though both run in the same process.
+    """
+    def __init__(self, sink, depth=1):
+        """
+
+        :param sink: The :py:class:`~skald.sinks.Sink` to write to.
+        :param depth: The number of documents that can wait to be written
+            before :py:meth:`~skald.sinks.ThreadedSink.write` blocks.
+        """
+        self.sink = sink
+        self.documents = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            document = self.documents.get()
+            if document is None:
+                return
+            if self.error is None:
+                try:
+                    self.sink.write(*document)
+                except BaseException as e:
+                    self.error = e
+
+    def write(self, name, img, config):
+        if self.error is not None:
+            raise self.error
+        self.documents.put((name, img, config))
+        return [get_variant_file(name, variant)
+                for variant in config.variants]
+
+    def close(self):
+        self.documents.put(None)
+        self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+class PrefixSink(Sink):
+    """Writes documents into a folder of another, usually shared, sink.
+
+    Closing it does not close the other sink, which is left to its owner.
+    """
+    def __init__(self, sink, prefix):
+        """
+
+        :param sink: The :py:class:`~skald.sinks.Sink` to write to.
+        :param prefix: The folder to put documents in.
+        """
+        self.sink = sink
+        self.prefix = prefix
+
+    def write(self, name, img, config):
+        return self.sink.write(os.path.join(self.prefix, name), img, config)
+
+class DirectorySink(Sink):
+    """Writes every document to a file in a folder, in the same layout as
+    the screenshots they are created from.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+
+    def write_file(self, name, img, format):
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        print("Saving to file", path)
+        img.save(path, format=format)
+
+class MemorySink(Sink):
+    """Collects the encoded documents in memory, in
+    :py:attr:`~skald.sinks.MemorySink.documents`.
+    """
+    def __init__(self):
+        self.documents = OrderedDict()
+
+    def write_file(self, name, img, format):
+        self.documents[name] = encode_image(img, format)
+
+class ArchiveSink(Sink):
+    """Streams every document into a single zip or tar archive.
+
+    Entries are written as soon as each document is rendered, so only one
+    document is held in memory at a time, and uploading a single archive
+    avoids the overhead of uploading many small files.
+    """
+    def __init__(self, path, format=None):
+        """
+
+        :param path: Path of the archive, or a writable binary file object.
+        :param format: Either ``zip`` or ``tar``. If not given, it is guessed
+            from the extension of ``path``, defaulting to ``zip``.
+        """
+        if format is None:
+            format = "zip"
+            if isinstance(path, str) and path.endswith(".tar"):
+                format = "tar"
+        self.format = format
+        if format == "zip":
+            # Images are already compressed, so they are stored as is.
+            self.archive = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        elif format == "tar":
+            if isinstance(path, str):
+                self.archive = tarfile.open(path, "w|")
+            else:
+                self.archive = tarfile.open(fileobj=path, mode="w|")
+        else:
+            raise ValueError("Unsupported archive format '%s'" % format)
+
+    def write_file(self, name, img, format):
+        data = encode_image(img, format)
+        name = name.replace(os.sep, "/")
+        print("Adding to archive", name)
+        if self.format == "zip":
+            self.archive.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+def pack_shelves(sizes, max_width):
+    """Packs rectangles into rows, known as shelves, from the tallest to the
+    lowest, starting a new shelf when the next rectangle does not fit in the
+    width.
+
+    :param sizes: A list of 2-tuples of width and height.
+    :param max_width: The width of the shelves. Widened to the widest
+        rectangle if that is wider.
+    :return: A 2-tuple of a list with the position of each rectangle, in the
+        order of ``sizes``, and the size of the area needed for all of them.
+    """
+    width = max([max_width] + [size[0] for size in sizes])
+    order = sorted(range(len(sizes)),
+            key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    positions = [None] * len(sizes)
+    x = y = shelf_height = used_width = 0
+    for i in order:
+        size = sizes[i]
+        if x > 0 and x + size[0] > width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += size[0]
+        shelf_height = max(shelf_height, size[1])
+        used_width = max(used_width, x)
+    return positions, (used_width, y + shelf_height)
+
+class SpriteSink(Sink):
+    """Packs documents into sprite sheets, so that a page showing many
+    documents loads a single image rather than one per document.
+
+    Each sheet is written when the sink is closed, along with a JSON map
+    ending with ``.map.json`` and a CSS file, giving the offset and size of
+    every document in it. Every sheet is encoded once, rather than every
+    document.
+    """
+    def __init__(self, folder, name="sprites", max_width=2048,
+            group_by_folder=True):
+        """
+
+        :param folder: The folder to write sheets to.
+        :param name: The file name of each sheet, without extension.
+        :param max_width: The width to fill before starting a new row of
+            documents. Sheets are wider if a document is wider.
+        :param group_by_folder: If ``True``, the documents of each folder are
+            packed into a sheet in that folder. Otherwise every document is
+            packed into a single sheet.
+        """
+        self.folder = folder
+        self.name = name
+        self.max_width = max_width
+        self.group_by_folder = group_by_folder
+        self.sheets = OrderedDict()
+
+    def write(self, name, img, config):
+        group = os.path.dirname(name) if self.group_by_folder else ""
+        names = []
+        for variant, reduced in iter_variants(img, config.variants):
+            if reduced is img:
+                # The rendered image may be reused once this returns.
+                reduced = img.copy()
+            sheet_name = os.path.join(group,
+                    get_variant_file(self.name, variant))
+            sheet = self.sheets.setdefault(sheet_name, (variant, []))
+            sheet[1].append((name, reduced))
+            names.append(sheet_name)
+        return names
+
+    def get_key(self, name):
+        """Gets the key of a document in the map of its sheet."""
+        if self.group_by_folder:
+            name = os.path.basename(name)
+        return os.path.splitext(name)[0].replace(os.sep, "/")
+
+    def write_sheet(self, sheet_name, variant, documents):
+        sizes = [img.size for name, img in documents]
+        positions, size = pack_shelves(sizes, self.max_width)
+        mode = "RGB"
+        if variant.format != "JPEG" and any(img.mode == "RGBA"
+                for name, img in documents):
+            mode = "RGBA"
+        sheet = Image.new(mode, size)
+        for (name, img), position in zip(documents, positions):
+            if img.mode != mode:
+                img = img.convert(mode)
+            sheet.paste(img, position)
+
+        path = os.path.join(self.folder, sheet_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print("Saving sprite sheet", path)
+        sheet.save(path, format=variant.format)
+
+        image = os.path.basename(sheet_name)
+        sprites = OrderedDict()
+        rules = []
+        for (name, img), position in zip(documents, positions):
+            key = self.get_key(name)
+            sprites[key] = {"x": position[0], "y": position[1],
+                    "width": img.width, "height": img.height}
+            rules.append(".skald-%s {\n"
+                    "    background: url(%s) %dpx %dpx;\n"
+                    "    width: %dpx;\n"
+                    "    height: %dpx;\n"
+                    "}\n" % (re.sub(r"[^A-Za-z0-9_-]", "-", key), image,
+                        -position[0], -position[1], img.width, img.height))
+
+        # Not named like the sheet, so the map is not mistaken for the
+        # metadata of a screenshot.
+        base, _ = os.path.splitext(path)
+        with open(base + ".map.json", "w") as map_file:
+            json.dump({"image": image, "width": size[0], "height": size[1],
+                "sprites": sprites}, map_file, indent=4)
+        with open(base + ".css", "w") as css_file:
+            css_file.write("\n".join(rules))
+
+    def close(self):
+        for sheet_name, (variant, documents) in self.sheets.items():
+            self.write_sheet(sheet_name, variant, documents)
+        self.sheets.clear()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Sphinx extension rendering the skald documents referenced by the pages
+being built.
+
+Add ``skald.sphinx`` to ``extensions`` in ``conf.py``, and reference a
+document by the path of its screenshot in the screenshot folder, without
+extension, and the name of the document::
+
+    .. skald-document:: flow/page login-form
+       :alt: The login form
+
+Only referenced documents are rendered, and each is cached by a hash of its
+content, see :py:func:`~skald.webdoc.render_cached`, so a build only renders
+the documents that have changed since the last build.
+
+The extension is configured in ``conf.py`` with:
+
+* ``skald_config``: The path to the skald configuration, relative to
+  ``conf.py``. A relative screenshot folder in the configuration is taken as
+  relative to the configuration file. Defaults to the directory of
+  ``conf.py``.
+* ``skald_cache_folder``: Where rendered documents are cached. Defaults to a
+  folder inside the doctree directory of the build.
+"""
+import os
+
+from docutils import nodes
+from docutils.parsers.rst import directives
+from sphinx.util.docutils import SphinxDirective
+
+from . import __version__
+from .configuration import read_configuration, get_configuration_path
+from .definitions import load
+from .webdoc import render_cached
+
+def get_configuration(app):
+    """Reads the skald configuration once per build."""
+    config = getattr(app, "_skald_config", None)
+    if config is None:
+        path = get_configuration_path(os.path.join(app.confdir,
+            app.config.skald_config or ""))
+        config = read_configuration(path)
+        app._skald_config_path = os.path.abspath(path)
+        base = os.path.dirname(os.path.abspath(path))
+        config.folder = os.path.join(base, config.folder)
+        config.output_folder = os.path.join(base, config.output_folder)
+        if config.cache_folder is not None:
+            config.cache_folder = os.path.join(base, config.cache_folder)
+        app._skald_config = config
+    return config
+
+def get_cache_folder(app):
+    if app.config.skald_cache_folder is not None:
+        return os.path.join(app.confdir, app.config.skald_cache_folder)
+    return os.path.join(app.doctreedir, "skald")
+
+class SkaldDocumentDirective(SphinxDirective):
+    """Inserts a rendered skald document as an image."""
+    required_arguments = 2
+    option_spec = {
+        "alt": directives.unchanged,
+        "width": directives.length_or_percentage_or_unitless,
+        "align": lambda argument: directives.choice(argument,
+            ("left", "center", "right")),
+        "class": directives.class_option,
+    }
+
+    def run(self):
+        app = self.env.app
+        config = get_configuration(app)
+        screenshot, document = self.arguments
+        metadata_path = os.path.join(config.folder, "%s.json" % screenshot)
+        try:
+            path = render_cached(metadata_path, document, config,
+                    get_cache_folder(app))
+        except (OSError, ValueError) as e:
+            raise self.error("Could not render skald document '%s' of '%s': "
+                    "%s" % (document, screenshot, e))
+        # Documents are rebuilt when the metadata, the screenshot or the
+        # configuration changes.
+        self.env.note_dependency(metadata_path)
+        self.env.note_dependency(os.path.join(config.folder,
+            load(metadata_path).image_path))
+        if os.path.exists(app._skald_config_path):
+            self.env.note_dependency(app._skald_config_path)
+
+        # Images are given relative to the page, and copied by Sphinx like
+        # any other image.
+        page_folder = os.path.dirname(self.env.doc2path(self.env.docname))
+        uri = os.path.relpath(path, page_folder).replace(os.sep, "/")
+        node = nodes.image(uri=uri, alt=self.options.get("alt", document),
+                classes=self.options.get("class", []))
+        for option in ("width", "align"):
+            if option in self.options:
+                node[option] = self.options[option]
+        return [node]
+
+def setup(app):
+    app.add_config_value("skald_config", None, "env")
+    app.add_config_value("skald_cache_folder", None, "env")
+    app.add_directive("skald-document", SkaldDocumentDirective)
+    return {"version": __version__, "parallel_read_safe": True}
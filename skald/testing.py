@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Stand-ins for a Selenium WebDriver and its WebElements, for measuring
+the capture side of skald without a browser.
+"""
+import io
+import time
+import hashlib
+from collections import Counter
+
+from .capture import PNGWriter, PAGE_SCRIPT, SCROLL_SCRIPT
+from .definitions import LAYOUT_SCRIPT
+
+def create_png(width, height):
+    """Creates a PNG of noise, which compresses about as badly as a busy
+    screenshot.
+
+    :return: The PNG as :py:obj:`bytes`.
+    """
+    # Noise repeating less often than the zlib window, so it stays
+    # incompressible without generating every pixel.
+    noise = b"".join(hashlib.sha256(str(i).encode("ascii")).digest()
+            for i in range(2048))
+    stride = width * 3
+    data = noise * (stride // len(noise) + 2)
+    file = io.BytesIO()
+    writer = PNGWriter(file, width, height)
+    for row in range(height):
+        start = (row * stride) % len(noise)
+        writer.write_rows(data[start:start + stride])
+    writer.close()
+    return file.getvalue()
+
+class FakeWebElement:
+    """An element of a :py:class:`~skald.testing.FakeWebDriver`.
+
+    Every attribute read is a round trip to the driver, as it is in
+    Selenium.
+    """
+    def __init__(self, driver, x, y, width, height, id=None):
+        self.driver = driver
+        self.id = id
+        self._rect = {"x": x, "y": y, "width": width, "height": height}
+
+    @property
+    def location(self):
+        self.driver.round_trip("location")
+        return {"x": self._rect["x"], "y": self._rect["y"]}
+
+    @property
+    def size(self):
+        self.driver.round_trip("size")
+        return {"width": self._rect["width"],
+                "height": self._rect["height"]}
+
+    @property
+    def rect(self):
+        self.driver.round_trip("rect")
+        return dict(self._rect)
+
+class FakeWebDriver:
+    """Behaves enough like a
+    :py:class:`~selenium.webdriver.remote.webdriver.WebDriver` for skald to
+    capture screenshots from it.
+
+    Every call is counted in :py:attr:`~skald.testing.FakeWebDriver.calls`
+    and delayed by ``latency``, simulating the round trip to a browser.
+    """
+    def __init__(self, width=1280, height=800, page_height=None, latency=0,
+            png=None, page=None, ratio=1):
+        """
+
+        :param width: Width of the viewport and screenshots in pixels.
+        :param height: Height of the viewport in pixels.
+        :param page_height: Height of the whole page, used when capturing
+            full pages. Defaults to ``height``.
+        :param latency: Seconds each call to the driver or an element takes.
+        :param png: The screenshot to return, as :py:obj:`bytes`. Defaults
+            to a PNG of noise the size of the viewport.
+        :param page: An optional :py:class:`~PIL.Image.Image` of the whole
+            page. Screenshots then show the part of it in the viewport, at
+            the current scroll position, and the size of the page is taken
+            from it.
+        :param ratio: The device pixel ratio of ``page``, the number of
+            image pixels per CSS pixel.
+        """
+        self.page = page
+        self.ratio = ratio
+        if page is not None:
+            width = page.width // ratio
+            page_height = page.height // ratio
+        self.width = width
+        self.height = height
+        if page_height is None:
+            page_height = height
+        self.page_height = page_height
+        self.latency = latency
+        self.calls = Counter()
+        self.y = 0
+        self.elements = []
+        self._png = png
+
+    @property
+    def round_trips(self):
+        """The total number of calls made."""
+        return sum(self.calls.values())
+
+    def round_trip(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_screenshot_as_png(self):
+        self.round_trip("get_screenshot_as_png")
+        if self.page is not None:
+            top = self.y * self.ratio
+            viewport = self.page.crop((0, top, self.page.width,
+                top + self.height * self.ratio))
+            data = io.BytesIO()
+            viewport.save(data, format="PNG")
+            return data.getvalue()
+        if self._png is None:
+            self._png = create_png(self.width, self.height)
+        return self._png
+
+    def execute_script(self, script, *args):
+        self.round_trip("execute_script")
+        if script == PAGE_SCRIPT:
+            return {"height": self.page_height, "viewport": self.height,
+                    "x": 0, "y": self.y}
+        elif script == SCROLL_SCRIPT:
+            self.y = max(0, min(args[1], self.page_height - self.height))
+            return self.y
+        elif script == LAYOUT_SCRIPT:
+            return dict(("#%s" % element.id, dict(element._rect, visible=True))
+                    for element in self.elements if element.id is not None)
+        return None
+
+    def create_elements(self, count, width=120, height=30):
+        """Creates ``count`` elements laid out in a grid on the page, without
+        counting any calls. The elements have the ids ``element0``,
+        ``element1`` and so on, and are included in layout snapshots.
+
+        :return: A list of :py:class:`~skald.testing.FakeWebElement`.
+        """
+        columns = max(1, self.width // (width * 2))
+        elements = []
+        for i in range(count):
+            row, column = divmod(i, columns)
+            elements.append(FakeWebElement(self, column * width * 2 + 10,
+                row * height * 2 + 10, width, height,
+                id="element%d" % len(self.elements)))
+            self.elements.append(elements[-1])
+        return elements
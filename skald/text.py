@@ -24,7 +24,10 @@ class TextArea:
         height = 0
         width = 0
         for line in lines:
-            size = Size(*font.getsize(line))
+            # The right and bottom of the bounding box from the origin, as
+            # the removed getsize gave.
+            left, top, right, bottom = font.getbbox(line)
+            size = Size(right, bottom)
             sizes.append(size)
             width = max(size.width, width)
             height += size.height
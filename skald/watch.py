@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+
+from .configuration import read_configurations, get_configuration_path
+from .definitions import (load, ScreenshotEncoder, OBJECTS_FOLDER,
+        SPOOL_FOLDER)
+from .webdoc import (ImageCache, get_screenshots, get_output_file,
+        get_content_addressed_image, get_patch_cache, process_document,
+        claim_screenshots, get_content_map, process_screenshots,
+        process_profiles)
+
+def encode_documents(metadata):
+    """Encodes each document of a screenshot, to tell which have changed.
+
+    :return: A dictionary mapping the name of each document to its JSON.
+    """
+    return dict((document.name, json.dumps(document, cls=ScreenshotEncoder))
+            for document in metadata.documents)
+
+class Watcher:
+    """Watches the screenshot folder and re-renders documents as their
+    screenshots or metadata change.
+
+    Changes are detected by polling the modification times of the files, so
+    no platform specific file system notification service is needed. If the
+    configuration has ``spool`` set, screenshots are instead rendered as
+    they are registered in the spool folder, without scanning the folder.
+    The configuration, fonts and the most recently changed screenshots are
+    kept in memory between renders.
+
+    If the configuration defines profiles, every profile is rendered, see
+    :py:func:`~skald.configuration.read_configurations`. Screenshots are
+    read from the folder of the first profile.
+    """
+    def __init__(self, config_path=None, interval=0.5, images=8):
+        """
+
+        :param config_path: The path to the configuration, see
+            :py:func:`~skald.configuration.read_configuration`.
+        :param interval: Number of seconds between each poll.
+        :param images: Number of decoded screenshots to keep in memory.
+        """
+        self.config_path = get_configuration_path(config_path)
+        self.interval = interval
+        self.images = ImageCache(size=images)
+        self.read_configuration()
+        self.mtimes = {}
+        self.documents = {}
+
+    def read_configuration(self):
+        self.configs = read_configurations(self.config_path)
+        self.config = self.configs[0]
+        self.patches = get_patch_cache(self.config)
+
+    def scan(self):
+        """Gets the modification time of the configuration file and all
+        screenshots and metadata files.
+        """
+        mtimes = {}
+        if os.path.exists(self.config_path):
+            mtimes[self.config_path] = os.path.getmtime(self.config_path)
+        if self.config.spool:
+            return mtimes
+        for root, dirs, files in os.walk(self.config.folder):
+            if root == self.config.folder:
+                dirs[:] = [name for name in dirs
+                        if name not in (OBJECTS_FOLDER, SPOOL_FOLDER)]
+            for name in files:
+                if os.path.splitext(name)[1] not in (".png", ".json"):
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    mtimes[path] = os.path.getmtime(path)
+                except FileNotFoundError:
+                    pass
+        return mtimes
+
+    def poll(self):
+        """Scans for changes since the last poll.
+
+        :return: A :py:obj:`set` of paths that are new or changed.
+        """
+        mtimes = self.scan()
+        changed = set(path for path, mtime in mtimes.items()
+                if self.mtimes.get(path) != mtime)
+        self.mtimes = mtimes
+        return changed
+
+    def get_changed_screenshots(self, changed):
+        """Finds the screenshots affected by the ``changed`` paths.
+
+        :return: A list of screenshots as returned by
+            :py:func:`~skald.webdoc.get_screenshots`, and a :py:obj:`set` of
+            the image paths that have changed.
+        """
+        screenshots = {}
+        images = set()
+        for path in changed:
+            file_name, file_extension = os.path.splitext(path)
+            image = file_name + ".png"
+            metadata = file_name + ".json"
+            if metadata not in self.mtimes:
+                continue
+            if image in self.mtimes:
+                screenshots[file_name] = {"image": image, "metadata": metadata}
+                if file_extension == ".png":
+                    images.add(image)
+            elif file_extension == ".json":
+                # Content addressed images never change, only the metadata
+                # referencing them.
+                image = get_content_addressed_image(metadata,
+                        self.config.folder)
+                if image is not None:
+                    screenshots[file_name] = {"image": image,
+                            "metadata": metadata}
+        return list(screenshots.values()), images
+
+    def render(self, screenshot, image_changed=True):
+        """Renders the documents of ``screenshot`` that have changed since
+        they were last rendered.
+        """
+        metadata = load(screenshot["metadata"])
+        base_image = os.path.join(self.config.folder, metadata.image_path)
+        previous_image, previous = self.documents.get(screenshot["metadata"],
+                (None, {}))
+        if image_changed:
+            self.images.discard(base_image)
+        if image_changed or previous_image != base_image:
+            previous = {}
+
+        rendered = encode_documents(metadata)
+        content = None
+        for document in metadata.documents:
+            if previous.get(document.name) == rendered[document.name]:
+                continue
+            for config in self.configs:
+                output = get_output_file(metadata.meta_path, document.name,
+                        config)
+                if content is None:
+                    content = get_content_map(self.images.get(base_image),
+                            config)
+                process_document(base_image=self.images.get(base_image),
+                        document=document, config=config, output=output,
+                        patches=self.patches, content=content)
+        self.documents[screenshot["metadata"]] = (base_image, rendered)
+
+    def render_all(self):
+        """Renders every screenshot with the current configuration.
+
+        Screenshots are rendered as by ``skald``, one at a time and only
+        decoded as far as their documents need, so they are not kept in
+        memory.
+        """
+        self.images.clear()
+        self.documents.clear()
+        if self.config.spool:
+            # Everything is rendered, so pending registrations are obsolete.
+            claim_screenshots(self.config.folder)
+        for screenshot in get_screenshots(self.config.folder):
+            try:
+                metadata = load(screenshot["metadata"])
+                if len(self.configs) > 1:
+                    process_profiles([screenshot], self.configs)
+                else:
+                    process_screenshots([screenshot], self.config)
+            except Exception as e:
+                print("Failed to render", screenshot["metadata"], e)
+                continue
+            self.documents[screenshot["metadata"]] = (os.path.join(
+                self.config.folder, metadata.image_path),
+                encode_documents(metadata))
+
+    def update(self):
+        """Polls for changes once, and renders what has changed."""
+        changed = self.poll()
+        if self.config_path in changed:
+            print("Configuration changed, rendering everything")
+            self.read_configuration()
+            self.render_all()
+            return
+
+        if self.config.spool:
+            for screenshot in claim_screenshots(self.config.folder):
+                self._render(screenshot)
+            return
+
+        screenshots, images = self.get_changed_screenshots(changed)
+        for screenshot in screenshots:
+            self._render(screenshot, screenshot["image"] in images)
+
+    def _render(self, screenshot, image_changed=True):
+        try:
+            self.render(screenshot, image_changed)
+        except Exception as e:
+            # Files may be changed while being read, so report the error and
+            # wait for the next change instead of stopping.
+            print("Failed to render", screenshot["metadata"], e)
+
+    def watch(self):
+        """Renders everything once, and then re-renders changes until
+        interrupted.
+        """
+        self.poll()
+        self.render_all()
+        print("Watching", self.config.folder, "for changes")
+        while True:
+            time.sleep(self.interval)
+            self.update()
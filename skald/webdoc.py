@@ -1,31 +1,288 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import json
-from itertools import product
+import math
+import hashlib
+import threading
+from collections import OrderedDict, Counter, namedtuple
 
 from PIL import Image, ImageFont, ImageDraw
 
 from .geometry import Size, Point, Rectangle
 from .text import TextArea, TextAlign
-from .positioning import get_box_position, Choice
-from .definitions import load
+from .positioning import get_box_position, solve_placement, Choice
+from .pixelcache import PixelCache
+from .sinks import DirectorySink, ThreadedSink, save_variants, encode_image
+from .scheduler import MemoryScheduler, estimate_memory, prefetch
+from .definitions import (load, get_object_path, write_atomic, hash_file,
+        ScreenshotEncoder, OBJECTS_FOLDER, SPOOL_FOLDER)
 
-def get_output_file(image_path, document_name, config):
-    relative_image_dir = os.path.dirname(image_path)
-    output = os.path.join(config.folder, relative_image_dir, "%s.png" % document_name)
+RenderedDocument = namedtuple("RenderedDocument",
+        ["name", "image", "screenshot", "document"])
+
+class ImageCache:
+    """Keeps decoded base images in memory, so that they only have to be
+    decoded again when the file changes.
+
+    Images are keyed by their path and invalidated by the modification time
+    of the file.
+    """
+    def __init__(self, size=None):
+        """
+
+        :param size: The maximum number of images kept. When exceeded, the
+            least recently used image is discarded. ``None`` means no limit.
+        """
+        self.size = size
+        self._images = OrderedDict()
+
+    def get(self, path):
+        """Get the decoded image at ``path``."""
+        mtime = os.path.getmtime(path)
+        cached = self._images.get(path)
+        if cached is not None and cached[0] == mtime:
+            self._images.move_to_end(path)
+            return cached[1]
+
+        img = Image.open(path)
+        img.load()
+        self._images[path] = (mtime, img)
+        self._images.move_to_end(path)
+        if self.size is not None:
+            while len(self._images) > self.size:
+                self._images.popitem(last=False)
+        return img
+
+    def discard(self, path):
+        """Remove the image at ``path`` from the cache."""
+        self._images.pop(path, None)
+
+    def clear(self):
+        """Remove all images from the cache."""
+        self._images.clear()
+
+    def __len__(self):
+        return len(self._images)
+
+def limit_decoded_rows(img, bottom):
+    """Limits an opened, but not yet loaded, image to only decode the rows
+    above ``bottom``.
+
+    PNG images are decoded row by row from the top, so decoding stops once
+    the last needed row is read, and memory is only allocated for the rows
+    above it. Interlaced images and other formats are left untouched.
+
+    This relies on how Pillow stores the tiles and size of an opened image,
+    which is not public. If they are not as expected, the whole image is
+    decoded instead.
+
+    :param img: An :py:class:`~PIL.Image.Image` returned by
+        :py:func:`~PIL.Image.open`.
+    :param bottom: The number of rows from the top that are needed.
+    """
+    bottom = int(math.ceil(bottom))
+    if img.format != "PNG" or img.info.get("interlace") or len(img.tile) != 1:
+        return
+    if bottom < 1 or bottom >= img.height or not hasattr(img, "_size"):
+        return
+    tile = img.tile[0]
+    try:
+        decoder, extents, offset, args = tile
+    except (TypeError, ValueError):
+        return
+    if decoder != "zip" or tuple(extents) != (0, 0) + img.size:
+        return
+
+    size = img.size
+    extents = (0, 0, img.width, bottom)
+    if hasattr(tile, "_replace"):
+        img.tile = [tile._replace(extents=extents)]
+    else:
+        img.tile = [(decoder, extents, offset, args)]
+    img._size = (img.width, bottom)
+    if img.size != (size[0], bottom) or tuple(img.tile[0][1]) != extents:
+        img.tile = [tile]
+        img._size = size
+
+def load_image(base_image, crop=None):
+    """Get a copy of the base image which can be drawn on.
+
+    :param base_image: Either the path to the image, or an already decoded
+        :py:class:`~PIL.Image.Image`, e.g. from a
+        :py:class:`~skald.webdoc.ImageCache`.
+    :param crop: An optional :py:class:`~skald.geometry.Rectangle` to crop
+        the image to. If ``base_image`` is a path, only the rows needed for
+        the crop are decoded.
+    """
+    if isinstance(base_image, Image.Image):
+        if crop is None:
+            img = base_image.copy()
+        else:
+            img = base_image.crop(crop)
+        if img.mode == "RGBX":
+            img = img.convert("RGB")
+        return img
+
+    img = Image.open(base_image)
+    if crop is None:
+        return img.copy()
+    limit_decoded_rows(img, crop.bottom)
+    return img.crop(crop)
+
+def get_output_name(meta_path, document_name):
+    """Gets the path of a document relative to the screenshot folder."""
+    relative_dir = os.path.dirname(meta_path)
+    return os.path.join(relative_dir, "%s.png" % document_name)
+
+def get_output_file(meta_path, document_name, config):
+    output = os.path.join(config.output_folder,
+            get_output_name(meta_path, document_name))
     return output
 
-def draw_textarea(draw, textarea, config):
-    """Draws a tooltip on the image."""
+def render_textarea(textarea, config):
+    """Renders a tooltip onto a transparent RGBA patch the size of the
+    textarea.
+
+    The box and the text are drawn onto separate layers and composited, so
+    that translucent text is blended with the box rather than replacing it.
+    """
     font = config.font.get_font()
+    size = (int(round(textarea.width)), int(round(textarea.height)))
 
-    print("Drawing textarea at", textarea.rectangle)
-    draw.rectangle(textarea.rectangle, fill=config.tooltip.color)
+    patch = Image.new("RGBA", size, config.tooltip.color)
+    text = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(text)
     for i, line in enumerate(textarea.text):
-        position = textarea.get_line_position(i)
+        position = textarea.get_line_offset(i)
         draw.text(position, line, font=font, fill=config.font.color)
+    patch.alpha_composite(text)
+    return patch
+
+def get_patch_key(textarea, config):
+    """Gets a key identifying how a tooltip looks, covering its text and
+    every setting that affects how it is drawn.
+    """
+    font = config.font
+    key = json.dumps([textarea.text, textarea.line_sizes, textarea.wrapper,
+        textarea.line_spacing, textarea.padding, textarea.align.name,
+        font.path, font.size, font.color, config.tooltip.color])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+class PatchCache:
+    """Keeps rendered tooltips, so that identical tooltips are only rendered
+    once and then pasted into every document they appear in.
+
+    Patches are kept in memory, and optionally also stored on disk to be
+    reused between runs.
+    """
+    def __init__(self, size=256, folder=None):
+        """
+
+        :param size: The maximum number of patches kept in memory. When
+            exceeded, the least recently used patch is discarded.
+        :param folder: An optional folder to store patches in between runs.
+        """
+        self.size = size
+        self.folder = folder
+        self._patches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, textarea, config):
+        """Gets the rendered patch for ``textarea``, rendering it with
+        :py:func:`~skald.webdoc.render_textarea` if it is not cached.
+        """
+        key = get_patch_key(textarea, config)
+        with self._lock:
+            patch = self._patches.get(key)
+            if patch is not None:
+                self._patches.move_to_end(key)
+                return patch
+
+        patch = self._read(key)
+        if patch is None:
+            patch = render_textarea(textarea, config)
+            self._write(key, patch)
+
+        with self._lock:
+            self._patches[key] = patch
+            while len(self._patches) > self.size:
+                self._patches.popitem(last=False)
+        return patch
+
+    def clear(self):
+        """Remove all patches kept in memory."""
+        with self._lock:
+            self._patches.clear()
+
+    def _get_path(self, key):
+        return os.path.join(self.folder, key[:2], "%s.png" % key)
+
+    def _read(self, key):
+        if self.folder is None:
+            return None
+        try:
+            patch = Image.open(self._get_path(key))
+            patch.load()
+        except (OSError, ValueError):
+            return None
+        return patch
+
+    def _write(self, key, patch):
+        if self.folder is None:
+            return
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = io.BytesIO()
+        patch.save(data, format="PNG")
+        write_atomic(path, data.getvalue())
+
+def get_patch_cache(config):
+    """Gets a :py:class:`~skald.webdoc.PatchCache`, storing patches on disk
+    if the configuration has a cache folder.
+    """
+    folder = None
+    if config.cache_folder is not None:
+        folder = os.path.join(config.cache_folder, "patches")
+    return PatchCache(folder=folder)
+
+def composite_patch(img, patch, position):
+    """Alpha composites ``patch`` into ``img`` at ``position``.
+
+    Only the region covered by the patch is touched, so the cost is
+    proportional to the size of the patch rather than the size of the image.
+    """
+    left, top = int(round(position.x)), int(round(position.y))
+    box = (max(left, 0), max(top, 0), min(left + patch.width, img.width),
+            min(top + patch.height, img.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return
+    if box != (left, top, left + patch.width, top + patch.height):
+        patch = patch.crop((box[0] - left, box[1] - top, box[2] - left,
+            box[3] - top))
+
+    if img.mode == "RGBA":
+        img.alpha_composite(patch, dest=box[:2])
+    else:
+        img.paste(patch, box[:2], mask=patch)
 
-def get_textarea(tooltip, element, bounds, config, avoid):
+def draw_textarea(img, textarea, config, offset=Point(0, 0), patches=None):
+    """Draws a tooltip on the image, blending it according to the alpha
+    channel of the tooltip and font colors.
+
+    :param offset: The position in the screenshot of the top left corner of
+        ``img``, used when ``img`` is cropped.
+    :param patches: An optional :py:class:`~skald.webdoc.PatchCache` to
+        reuse the rendered tooltip from.
+    """
+    print("Drawing textarea at", textarea.rectangle)
+    if patches is not None:
+        patch = patches.get(textarea, config)
+    else:
+        patch = render_textarea(textarea, config)
+    composite_patch(img, patch, textarea.position - offset)
+
+def get_textarea(tooltip, element, bounds, config, avoid, content=None):
     font = config.font.get_font()
 
     textarea = TextArea.from_lines(
@@ -37,40 +294,128 @@ def get_textarea(tooltip, element, bounds, config, avoid):
 
     textarea.choices = get_box_position(element, tooltip, textarea.size,
             bounds, config.tooltip.margin, avoid=avoid,
-            penalties=config.penalties)
+            penalties=config.penalties, content=content)
 
     return textarea
 
 
-def make_combinations(textareas):
+def place_textareas(textareas, choice_lists=None):
+    """Positions each textarea at one of its choices, so that no textareas
+    overlap and the sum of the penalties is as low as possible.
+
+    :param choice_lists: The choices to select from for each textarea.
+        Defaults to the choices of each textarea.
+    :return: ``False`` if no combination of choices avoids overlap.
+    """
+    if choice_lists is None:
+        choice_lists = [textarea.choices for textarea in textareas]
+    selected = solve_placement(choice_lists)
+    if selected is None:
+        return False
+    for textarea, choice in zip(textareas, selected):
+        textarea.position = choice.rectangle.position
+    return True
+
+def get_placement_file(output, config):
+    """Gets the path where the placement of a document's tooltips is
+    stored between runs, or ``None`` if the configuration does not keep
+    placements.
+
+    :param output: The path of the document, as given by
+        :py:func:`~skald.webdoc.get_output_file`, or ``None`` if the
+        document is not rendered to a file of its own.
+    """
+    if (output is None or not config.keep_placement
+            or config.cache_folder is None):
+        return None
+    key = hashlib.sha1(os.path.normpath(output).encode("utf-8")).hexdigest()
+    return os.path.join(config.cache_folder, "placements", "%s.json" % key)
+
+def read_placement(path):
+    """Reads a placement written by :py:func:`~skald.webdoc.write_placement`.
+
+    :return: A list of placed tooltips, or ``None`` if there is no valid
+        placement stored at ``path``.
+    """
+    if path is None:
+        return None
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)["textareas"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_placement(path, textareas, anchors):
+    """Stores the position of each textarea relative to the element it
+    annotates, along with the text and element it was placed for.
+    """
+    placement = {"textareas": [{
+        "lines": textarea.text,
+        "element": anchor.rectangle,
+        "offset": textarea.position - anchor.location,
+    } for textarea, anchor in zip(textareas, anchors)]}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, json.dumps(placement).encode("utf-8"))
+
+def _overlaps(rectangle, rectangles):
+    return any(rectangle in other for other in rectangles)
+
+def seed_placement(textareas, anchors, previous):
+    """Places textareas where they were placed in a previous run.
+
+    Each textarea is matched with a previously placed textarea with the same
+    text, and keeps its position relative to its element if that is still
+    one of its choices. If every textarea keeps its position without
+    overlapping the others, the previous placement is reused as is.
+    Otherwise, the textareas that kept their position are fixed, and only
+    the remaining ones are placed around them.
+
+    :param textareas: The :py:class:`~skald.text.TextArea` instances to
+        place, with their choices found.
+    :param anchors: The :py:class:`~skald.definitions.Element` each textarea
+        annotates.
+    :param previous: The previous placement, as returned by
+        :py:func:`~skald.webdoc.read_placement`.
+    :return: ``True`` if every textarea was placed, and ``False`` if the
+        textareas have to be placed from scratch.
+    """
+    unused = list(previous)
+    seeded = []
+    for textarea, anchor in zip(textareas, anchors):
+        choice = None
+        for entry in unused:
+            if entry["lines"] == textarea.text:
+                unused.remove(entry)
+                offset = Point(*entry["offset"])
+                for candidate in textarea.choices:
+                    position = candidate.rectangle.position - anchor.location
+                    if position == offset:
+                        choice = candidate
+                        break
+                break
+        seeded.append(choice)
+
+    fixed = []
+    free = []
+    for textarea, choice in zip(textareas, seeded):
+        rectangles = [c.rectangle for t, c in fixed]
+        if choice is not None and not _overlaps(choice.rectangle, rectangles):
+            fixed.append((textarea, choice))
+        else:
+            free.append(textarea)
+
+    rectangles = [c.rectangle for t, c in fixed]
     choice_lists = []
-    for textarea in textareas:
-        choices = []
-        for choice in textarea.choices:
-            choices.append({"textarea": textarea, "choice": choice})
-        choice_lists.append(choices)
-    return list(product(*choice_lists))
-
-def best_combinations(combinations):
-    """Selects the best combination of positions for `textareas` based on each
-    textarea's positional choices and their relative punshiment, disallowing
-    any overlap between textareas.
-    """
-    indices = set()
-    for i, combination in enumerate(combinations):
-        crash = False
-        for c1 in combination:
-            for c2 in combination:
-                if c1["textarea"] != c2["textarea"]:
-                    if c1["choice"].rectangle in c2["choice"].rectangle:
-                        crash = True
-        if not crash:
-            indices.add(i)
-    combinations = [c for i, c in enumerate(combinations) if i in indices]
-    combinations.sort(key=lambda x: sum([y["choice"].penalty for y in x]))
-    combination = combinations[0]
-    for area in combination:
-        area["textarea"].position = area["choice"].rectangle.position
+    for textarea in free:
+        choice_lists.append([choice for choice in textarea.choices
+            if not _overlaps(choice.rectangle, rectangles)])
+    if not place_textareas(free, choice_lists):
+        return False
+
+    for textarea, choice in fixed:
+        textarea.position = choice.rectangle.position
+    return True
 
 def get_image_size_from_crop(crop, image_size):
     new_size = list(crop)
@@ -108,55 +453,579 @@ def get_actual_crop_area(crop, image_size, all_elements, margin):
 
     return Rectangle(*crop)
 
-def process_document(base_image, document, config, output):
-    """Process a single document and create a documented screenshot."""
-    img = Image.open(base_image).copy()
-    image_size = document.crop
-    if image_size is not None:
-        image_size = get_image_size_from_crop(image_size, Size(*img.size))
-    else:
-        image_size = Rectangle.from_sizes(position=Point(0,0),
-                size=Size(*img.size))
+def get_image_size(base_image):
+    """Gets the size of the base image without decoding it.
+
+    :param base_image: Either the path to the image, or an already decoded
+        :py:class:`~PIL.Image.Image`.
+    """
+    if isinstance(base_image, Image.Image):
+        return Size(*base_image.size)
+    with Image.open(base_image) as img:
+        return Size(*img.size)
+
+def get_content_map(base_image, config):
+    """Gets the :py:class:`~skald.content.ContentMap` of the base image, or
+    ``None`` if the configuration does not penalise covering busy content.
+
+    :param base_image: Either the path to the image, or an already decoded
+        :py:class:`~PIL.Image.Image`. The whole image is decoded.
+    """
+    if not config.penalties.content:
+        return None
+    from .content import ContentMap
+
+    if isinstance(base_image, Image.Image):
+        return ContentMap.from_image(base_image)
+    with Image.open(base_image) as img:
+        return ContentMap.from_image(img)
 
-    draw = ImageDraw.Draw(img)
+def place_document(document, image_size, config, placement_file=None,
+        content=None):
+    """Finds the position of every tooltip in a document, and the area the
+    document should be cropped to.
+
+    Only the size of the base image is needed, so this can be done before
+    the image is decoded.
+
+    :param document: The :py:class:`~skald.definitions.Document` to place
+        tooltips for.
+    :param image_size: The :py:class:`~skald.geometry.Size` of the base
+        image.
+    :param placement_file: An optional path where the placement is stored
+        between runs. If a previous placement is stored there, it is used
+        as a starting point, see :py:func:`~skald.webdoc.seed_placement`,
+        which keeps tooltips in the same place between runs.
+    :param content: The :py:class:`~skald.content.ContentMap` of the base
+        image, as given by :py:func:`~skald.webdoc.get_content_map`.
+    :return: A 2-tuple of the placed :py:class:`~skald.text.TextArea`
+        instances and the :py:class:`~skald.geometry.Rectangle` to crop to.
+    """
+    crop = document.crop
+    if crop is None:
+        crop = Rectangle(".", ".", ".", ".")
+    bounds = get_image_size_from_crop(crop, image_size)
 
     textareas = []
+    anchors = []
 
     for element in document.elements:
         for tooltip in element.tooltips:
             textarea = get_textarea(tooltip=tooltip,
                     element=element,
-                    bounds=image_size,
+                    bounds=bounds,
                     config=config,
-                    avoid=document.elements)
+                    avoid=document.elements,
+                    content=content)
             textareas.append(textarea)
+            anchors.append(element)
+
+    previous = read_placement(placement_file)
+    if previous is None or not seed_placement(textareas, anchors, previous):
+        if not place_textareas(textareas):
+            raise ValueError("No placement of the tooltips in document '%s' "
+                    "avoids overlapping" % document.name)
+    if placement_file is not None:
+        write_placement(placement_file, textareas, anchors)
+
+    text_area_rectangles = [textarea.rectangle for textarea in textareas]
+    all_elements = text_area_rectangles + [e.rectangle for e in document.elements]
+    crop = get_actual_crop_area(crop, image_size, all_elements,
+            config.tooltip.margin)
+    return textareas, crop
 
-    combinations = make_combinations(textareas)
-    best_combinations(combinations)
+def render_document(base_image, textareas, crop, config, patches=None):
+    """Crops the base image and draws the placed tooltips on it.
 
-    text_area_rectangles = []
+    The image is cropped before drawing, so only the area that is kept is
+    drawn on, and if ``base_image`` is a path, only the rows above the
+    bottom of the crop are decoded.
 
+    :param patches: An optional :py:class:`~skald.webdoc.PatchCache` to
+        reuse rendered tooltips from.
+    """
+    crop = Rectangle(*[int(round(value)) for value in crop])
+    img = load_image(base_image, crop)
+    draw_textareas(img, textareas, crop, config, patches)
+    return img
+
+def draw_textareas(img, textareas, crop, config, patches=None):
+    """Draws placed tooltips on an image already cropped to ``crop``."""
     for textarea in textareas:
-        draw_textarea(draw, textarea, config)
-        text_area_rectangles.append(textarea.rectangle)
+        draw_textarea(img, textarea, config, offset=crop.position,
+                patches=patches)
 
-    all_elements = text_area_rectangles + [e.rectangle for e in document.elements]
-    crop = get_actual_crop_area(document.crop, Size(*img.size), all_elements, config.tooltip.margin)
+def save_patches(img, textareas):
+    """Copies the pixels of ``img`` that drawing ``textareas`` on it will
+    change, so that they can be put back with
+    :py:func:`~skald.webdoc.restore_patches`.
 
-    img = img.crop(box=crop)
+    :return: A list of 2-tuples of a box and the pixels inside it.
+    """
+    saved = []
+    for textarea in textareas:
+        rectangle = textarea.rectangle
+        # One extra pixel on each side covers rounding when drawing.
+        box = (max(int(math.floor(rectangle.left)) - 1, 0),
+                max(int(math.floor(rectangle.top)) - 1, 0),
+                min(int(math.ceil(rectangle.right)) + 1, img.width),
+                min(int(math.ceil(rectangle.bottom)) + 1, img.height))
+        if box[0] < box[2] and box[1] < box[3]:
+            saved.append((box, img.crop(box)))
+    return saved
 
-    print("Saving to file", output)
-    img.save(output)
+def restore_patches(img, saved):
+    """Puts back pixels copied by :py:func:`~skald.webdoc.save_patches`."""
+    for box, pixels in reversed(saved):
+        img.paste(pixels, box[:2])
 
-def process_screenshots(screenshots, config):
-    """Processes each screenshot to generate a documented screenshot."""
-    for screenshot in screenshots:
+def can_draw_in_place(base_image, crop):
+    """Checks if a document cropped to ``crop`` can be drawn directly on
+    ``base_image`` instead of on a copy of it.
+
+    That is the case when the document covers the whole image and the image
+    is decoded and writable, unlike the read only images of a
+    :py:class:`~skald.pixelcache.PixelCache`.
+    """
+    if not isinstance(base_image, Image.Image):
+        return False
+    if base_image.readonly or base_image.mode not in ("RGB", "RGBA", "L"):
+        return False
+    crop = Rectangle(*[int(round(value)) for value in crop])
+    return crop == (0, 0, base_image.width, base_image.height)
+
+def draw_document(base_image, textareas, crop, config, patches=None,
+        in_place=False):
+    """Draws a placed document, either on a copy of the base image, or if
+    ``in_place`` is ``True`` and :py:func:`~skald.webdoc.can_draw_in_place`
+    allows it, directly on the base image.
+
+    :return: A generator yielding the rendered image once. When drawn in
+        place, the base image is restored when the generator is resumed, so
+        the image must be used before that.
+    """
+    if not (in_place and can_draw_in_place(base_image, crop)):
+        yield render_document(base_image, textareas, crop, config, patches)
+        return
+
+    saved = save_patches(base_image, textareas)
+    try:
+        draw_textareas(base_image, textareas, Rectangle(0, 0, 0, 0), config,
+                patches)
+        yield base_image
+    finally:
+        restore_patches(base_image, saved)
+
+def create_document(base_image, document, config, output, patches=None,
+        content=None):
+    """Places the tooltips of a document and draws them on the base image.
+
+    :param output: The path the document is written to, as given by
+        :py:func:`~skald.webdoc.get_output_file`. Used to keep the placement
+        of the tooltips between runs, unless ``None``.
+    :param content: The :py:class:`~skald.content.ContentMap` of the base
+        image. Found from the base image if needed and not given.
+    :return: The rendered :py:class:`~PIL.Image.Image`.
+    """
+    if content is None:
+        content = get_content_map(base_image, config)
+    textareas, crop = place_document(document, get_image_size(base_image),
+            config, get_placement_file(output, config), content)
+    return render_document(base_image, textareas, crop, config, patches)
+
+def get_document_key(metadata, document, image, config):
+    """Gets a hash of everything that affects how a rendered document looks:
+    the document, the screenshot image and the configuration.
+
+    :param metadata: The :py:class:`~skald.definitions.Screenshot` the
+        document belongs to.
+    :param image: The path of the screenshot image. Only read if the
+        screenshot is not content addressed.
+    """
+    image_hash = metadata.image_hash
+    if image_hash is None:
+        image_hash = hash_file(image)
+    font = config.font
+    tooltip = config.tooltip
+    key = json.dumps([json.dumps(document, cls=ScreenshotEncoder),
+        image_hash, font.path, font.size, font.color, tooltip.color,
+        tooltip.padding, tooltip.margin, tooltip.line_spacing,
+        config.penalties.move, config.penalties.content])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def render_cached(metadata_path, document_name, config, cache_folder):
+    """Renders a single document into a cache keyed by
+    :py:func:`~skald.webdoc.get_document_key`, unless it is already there.
+
+    Lets tools such as documentation builds render only the documents they
+    reference, and only when they have changed.
+
+    :param metadata_path: The path of the screenshot metadata.
+    :param document_name: The name of the document to render.
+    :return: The path of the rendered PNG.
+    :raises ValueError: If the screenshot has no document with that name.
+    """
+    metadata = load(metadata_path)
+    for document in metadata.documents:
+        if document.name == document_name:
+            break
+    else:
+        raise ValueError("Screenshot '%s' has no document '%s'" %
+                (metadata_path, document_name))
+
+    image = os.path.join(config.folder, metadata.image_path)
+    key = get_document_key(metadata, document, image, config)
+    path = os.path.join(cache_folder, key[:2], "%s.png" % key)
+    if os.path.exists(path):
+        return path
+
+    # The placement of a previous run is not part of the key, so none is
+    # used, and the same key always gives the same image.
+    img = create_document(image, document, config, None)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, encode_image(img, "PNG"))
+    return path
+
+def process_document(base_image, document, config, output, patches=None,
+        content=None):
+    """Process a single document and create a documented screenshot."""
+    img = create_document(base_image, document, config, output, patches,
+            content)
+    save_variants(img, output, config)
+
+def render_screenshot(screenshot, config, images=None, patches=None,
+        in_place=False):
+    """Renders every document of a single screenshot.
+
+    :param screenshot: A screenshot as returned by
+        :py:func:`~skald.webdoc.get_screenshots`.
+    :param images: An optional :py:class:`~skald.webdoc.ImageCache` or
+        :py:class:`~skald.pixelcache.PixelCache` to get the decoded base image
+        from. If not given, the image is only decoded once, down to the
+        lowest row any document is cropped to.
+    :param patches: An optional :py:class:`~skald.webdoc.PatchCache` to
+        reuse rendered tooltips from.
+    :param in_place: If ``True``, documents covering the whole screenshot
+        are drawn directly on the decoded screenshot, and the pixels under
+        their tooltips are restored once the next document is requested.
+        Each document then only costs a copy of its tooltip areas, but its
+        image is only valid until the generator is advanced.
+    :return: A generator of :py:class:`~skald.webdoc.RenderedDocument`.
+    """
+    metadata, base_image, placed = place_screenshot(screenshot, config,
+            images)
+    for name, document, textareas, crop in placed:
+        for img in draw_document(base_image, textareas, crop, config,
+                patches, in_place):
+            yield RenderedDocument(name=name, image=img, screenshot=metadata,
+                    document=document)
+
+def place_screenshot(screenshot, config, images=None):
+    """Reads the metadata of a screenshot, gets its image and places the
+    tooltips of its documents.
+
+    :param images: See :py:func:`~skald.webdoc.render_screenshot`.
+    :return: A 3-tuple of the :py:class:`~skald.definitions.Screenshot`,
+        the base image, either decoded or as a path if it is only decoded
+        for a single document, and a list of a 4-tuple for each document
+        of its output name, the :py:class:`~skald.definitions.Document`,
+        the placed :py:class:`~skald.text.TextArea` instances and the crop
+        :py:class:`~skald.geometry.Rectangle`.
+    """
+    metadata = load(screenshot["metadata"])
+    base_image = os.path.join(config.folder, metadata.image_path)
+    if (images is None and len(metadata.documents) > 1
+            and config.penalties.content):
+        # The content map needs the whole image anyway.
+        images = ImageCache(size=1)
+    if images is not None:
+        base_image = images.get(base_image)
+    content = get_content_map(base_image, config)
+    image_size = get_image_size(base_image)
+
+    placed = []
+    for document in metadata.documents:
+        name = get_output_name(metadata.meta_path, document.name)
+        output = os.path.join(config.output_folder, name)
+        textareas, crop = place_document(document, image_size, config,
+                get_placement_file(output, config), content)
+        placed.append((name, document, textareas, crop))
+    if not isinstance(base_image, Image.Image) and len(placed) > 1:
+        # Decoded once for every document, but only down to the lowest
+        # crop.
+        base_image = decode_rows(base_image,
+                max(crop.bottom for name, document, textareas, crop
+                    in placed))
+    return metadata, base_image, placed
+
+def decode_rows(path, bottom):
+    """Decodes the rows of an image above ``bottom``, see
+    :py:func:`~skald.webdoc.limit_decoded_rows`.
+    """
+    img = Image.open(path)
+    limit_decoded_rows(img, bottom)
+    img.load()
+    return img
+
+def get_image_source(screenshots, config):
+    """Chooses where the decoded image of each screenshot is taken from:
+    the pixel cache if the configuration has one, or otherwise an image
+    cache shared by the screenshots using the same image. Other images are
+    decoded once per screenshot, and only as far as needed.
+
+    Screenshots sharing an image must then be rendered in succession, such
+    as sorted by their image.
+
+    :return: A function taking a screenshot and returning the ``images`` to
+        give to :py:func:`~skald.webdoc.render_screenshot`.
+    """
+    pixels = get_pixel_cache(config)
+    if pixels is not None:
+        return lambda screenshot: pixels
+    uses = Counter(screenshot["image"] for screenshot in screenshots)
+    shared = ImageCache(size=1)
+    return lambda screenshot: (shared if uses[screenshot["image"]] > 1
+            else None)
+
+def prepare_screenshot(screenshot, config, images=None):
+    """Does everything needed to render the documents of a screenshot except
+    drawing: reads the metadata, places the tooltips and decodes the part of
+    the image each document is cropped to.
+
+    :param images: See :py:func:`~skald.webdoc.render_screenshot`.
+    :return: A 2-tuple of the :py:class:`~skald.definitions.Screenshot` and
+        a list with a 5-tuple for each document of its output name, the
+        :py:class:`~skald.definitions.Document`, the placed
+        :py:class:`~skald.text.TextArea` instances, the crop
+        :py:class:`~skald.geometry.Rectangle` and the cropped
+        :py:class:`~PIL.Image.Image`.
+    """
+    metadata, base_image, placed = place_screenshot(screenshot, config,
+            images)
+    prepared = []
+    for name, document, textareas, crop in placed:
+        crop = Rectangle(*[int(round(value)) for value in crop])
+        prepared.append((name, document, textareas, crop,
+            load_image(base_image, crop)))
+    return metadata, prepared
+
+def render_pipelined(screenshots, config, depth):
+    """Renders every document of each screenshot, while the next
+    screenshots are prepared by :py:func:`~skald.webdoc.prepare_screenshot`
+    in a background thread.
+
+    :param depth: The number of screenshots to prepare ahead.
+    :return: A generator of :py:class:`~skald.webdoc.RenderedDocument`.
+    """
+    get_images = get_image_source(screenshots, config)
+    patches = get_patch_cache(config)
+    def prepare(screenshot):
+        return prepare_screenshot(screenshot, config, get_images(screenshot))
+
+    for metadata, prepared in prefetch(prepare,
+            sorted(screenshots, key=lambda x: x["image"]), depth):
+        for name, document, textareas, crop, img in prepared:
+            draw_textareas(img, textareas, crop, config, patches)
+            yield RenderedDocument(name=name, image=img, screenshot=metadata,
+                    document=document)
+
+def get_pixel_cache(config):
+    """Gets the :py:class:`~skald.pixelcache.PixelCache` to use, or
+    ``None`` if caching is disabled.
+    """
+    if config.cache_folder is None:
+        return None
+    max_size = None
+    if config.pixel_cache_size is not None:
+        max_size = config.pixel_cache_size * 1024 * 1024
+    return PixelCache(os.path.join(config.cache_folder, "pixels"), max_size)
+
+def render_screenshots(screenshots, config, in_place=False):
+    """Renders every document of each screenshot, yielding them as they
+    are finished.
+
+    Screenshots sharing the same image, such as content addressed
+    screenshots, are rendered in succession so that the image is only
+    decoded once.
+
+    If the configuration has a memory budget, screenshots are instead
+    rendered concurrently by a :py:class:`~skald.scheduler.MemoryScheduler`,
+    and shared images are decoded once per screenshot. Otherwise, if it has
+    ``prefetch`` set, they are rendered by
+    :py:func:`~skald.webdoc.render_pipelined`.
+
+    :param in_place: If ``True``, documents are drawn directly on the
+        decoded screenshot when possible, see
+        :py:func:`~skald.webdoc.render_screenshot`. The image of each
+        document is then only valid until the generator is advanced. Ignored
+        when rendering concurrently or pipelined.
+
+    :return: A generator of :py:class:`~skald.webdoc.RenderedDocument`.
+    """
+    if config.memory_budget is None and config.prefetch:
+        for document in render_pipelined(screenshots, config,
+                config.prefetch):
+            yield document
+        return
+
+    pixels = get_pixel_cache(config)
+    patches = get_patch_cache(config)
+    if config.memory_budget is not None:
+        def render(screenshot):
+            return list(render_screenshot(screenshot, config, pixels,
+                patches))
+
+        def estimate(screenshot):
+            documents = len(load(screenshot["metadata"]).documents)
+            return estimate_memory(screenshot["image"], documents,
+                    content=bool(config.penalties.content))
+
+        scheduler = MemoryScheduler(config.memory_budget * 1024 * 1024,
+                workers=config.workers)
+        for documents in scheduler.iterate((estimate(screenshot), render,
+                (screenshot,)) for screenshot in screenshots):
+            for document in documents:
+                yield document
+        return
+
+    get_images = get_image_source(screenshots, config)
+    for screenshot in sorted(screenshots, key=lambda x: x["image"]):
+        for document in render_screenshot(screenshot, config,
+                images=get_images(screenshot), patches=patches,
+                in_place=in_place):
+            yield document
+
+def process_screenshots(screenshots, config, sink=None):
+    """Processes each screenshot to generate a documented screenshot.
+
+    :param sink: The :py:class:`~skald.sinks.Sink` to write documents to.
+        Defaults to writing each document to a file next to its screenshot
+        metadata.
+    """
+    if sink is None:
+        sink = DirectorySink(config.output_folder)
+    if config.prefetch:
+        sink = ThreadedSink(sink, config.prefetch)
+    try:
+        # Documents can only be drawn in place if they are written before
+        # the next one is rendered.
+        for rendered in render_screenshots(screenshots, config,
+                in_place=not config.prefetch):
+            sink.write(rendered.name, rendered.image, config)
+    finally:
+        sink.close()
+
+def get_layout_key(config):
+    """Gets the settings of a configuration that affect where tooltips are
+    placed. Configurations with the same key share placements.
+    """
+    return (config.font.path, config.font.size, config.tooltip.line_spacing,
+            config.tooltip.padding, config.tooltip.margin,
+            config.penalties.move, config.penalties.content,
+            config.cache_folder, config.keep_placement)
+
+def render_profiles(screenshots, configs, in_place=False):
+    """Renders every document of each screenshot once for each
+    configuration profile.
+
+    Each screenshot is decoded once for all profiles, and tooltips are
+    placed once for all profiles with the same
+    :py:func:`~skald.webdoc.get_layout_key`. Only drawing is repeated for
+    each profile. Screenshots are read from the folder of the first
+    profile, and decoded screenshots are cached in its pixel cache, if it
+    has one.
+
+    :param configs: A list of :py:class:`~skald.configuration.Configuration`,
+        such as returned by
+        :py:func:`~skald.configuration.read_configurations`.
+    :param in_place: If ``True``, documents covering the whole screenshot
+        are drawn directly on the decoded screenshot, see
+        :py:func:`~skald.webdoc.render_screenshot`.
+    :return: A generator of 2-tuples of the configuration and the
+        :py:class:`~skald.webdoc.RenderedDocument`.
+    """
+    groups = OrderedDict()
+    for config in configs:
+        groups.setdefault(get_layout_key(config), []).append(config)
+
+    base = configs[0]
+    # The content map is the same for every profile, and ignored by the
+    # profiles without a content penalty.
+    content_config = next((config for config in configs
+        if config.penalties.content), None)
+    images = get_pixel_cache(base) or ImageCache(size=1)
+    patches = get_patch_cache(base)
+    for screenshot in sorted(screenshots, key=lambda x: x["image"]):
         metadata = load(screenshot["metadata"])
+        base_image = images.get(
+                os.path.join(base.folder, metadata.image_path))
+        image_size = get_image_size(base_image)
+        content = None
+        if content_config is not None:
+            content = get_content_map(base_image, content_config)
         for document in metadata.documents:
-            output = get_output_file(metadata.image_path, document.name, config)
-            process_document(
-                base_image=os.path.join(config.folder, metadata.image_path),
-                document=document, config=config, output=output)
+            name = get_output_name(metadata.meta_path, document.name)
+            for group in groups.values():
+                layout = group[0]
+                placement_file = get_placement_file(
+                        os.path.join(layout.output_folder, name), layout)
+                textareas, crop = place_document(document, image_size,
+                        layout, placement_file, content)
+                for config in group:
+                    for rendered in draw_document(base_image, textareas,
+                            crop, config, patches, in_place):
+                        yield config, RenderedDocument(name=name,
+                                image=rendered, screenshot=metadata,
+                                document=document)
+
+def process_profiles(screenshots, configs, sinks=None):
+    """Processes each screenshot once for every configuration profile.
+
+    If the profiles have ``prefetch`` set, documents are encoded and written
+    in the background, but screenshots are not prepared ahead. A memory
+    budget is not used, as profiles are rendered one screenshot at a time.
+
+    See :py:func:`~skald.webdoc.render_profiles`.
+
+    :param sinks: A list with the :py:class:`~skald.sinks.Sink` to write
+        the documents of each profile to. Defaults to writing the documents
+        of each profile to its output folder.
+    """
+    if sinks is None:
+        sinks = [DirectorySink(config.output_folder) for config in configs]
+    prefetch_depth = configs[0].prefetch
+    if prefetch_depth:
+        sinks = [ThreadedSink(sink, prefetch_depth) for sink in sinks]
+    if configs[0].memory_budget is not None:
+        print("Rendering profiles one screenshot at a time, without the "
+                "memory budget")
+    by_config = dict((id(config), sink) for config, sink in zip(configs,
+        sinks))
+    try:
+        for config, rendered in render_profiles(screenshots, configs,
+                in_place=not prefetch_depth):
+            by_config[id(config)].write(rendered.name, rendered.image, config)
+    finally:
+        for sink in sinks:
+            sink.close()
+
+def get_content_addressed_image(metadata_path, path):
+    """Gets the image referenced by content addressed metadata.
+
+    :param metadata_path: Path to a JSON file.
+    :param path: The screenshot folder.
+    :return: The absolute path to the image, or ``None`` if ``metadata_path``
+        is not metadata for a content addressed screenshot.
+    """
+    try:
+        with open(metadata_path, "r") as json_file:
+            metadata = json.load(json_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(metadata, dict) or not metadata.get("image_hash"):
+        return None
+    return os.path.abspath(
+            os.path.join(path, get_object_path(metadata["image_hash"])))
 
 def get_screenshots(path):
     """Retrieves all screenshots with JSON metadata from the specified path."""
@@ -164,6 +1033,9 @@ def get_screenshots(path):
     image_files = {}
 
     for root, dirs, files in os.walk(path):
+        if root == path:
+            dirs[:] = [name for name in dirs
+                    if name not in (OBJECTS_FOLDER, SPOOL_FOLDER)]
         for name in files:
             file_path = os.path.join(root, name)
             file_name, file_extension = os.path.splitext(file_path)
@@ -178,4 +1050,115 @@ def get_screenshots(path):
                 "image": image_files[image_file],
                 "metadata": json_files[image_file]
                 })
+    for json_file in json_files:
+        if json_file not in image_files:
+            image = get_content_addressed_image(json_files[json_file], path)
+            if image is not None:
+                matching_files.append({
+                    "image": image,
+                    "metadata": json_files[json_file]
+                    })
     return matching_files
+
+def claim_screenshots(path):
+    """Claims the screenshots registered in the spool folder by
+    :py:func:`~skald.definitions.register_capture`.
+
+    Each registration is claimed by renaming it, so when several renderers
+    consume the same folder, every registration is claimed by exactly one
+    of them. Registrations are claimed in the order they were made.
+
+    :param path: The screenshot folder.
+    :return: A list of screenshots as returned by
+        :py:func:`~skald.webdoc.get_screenshots`.
+    """
+    spool = os.path.join(path, SPOOL_FOLDER)
+    try:
+        names = sorted(name for name in os.listdir(spool)
+                if name.endswith(".json"))
+    except FileNotFoundError:
+        return []
+
+    screenshots = OrderedDict()
+    for name in names:
+        entry = os.path.join(spool, name)
+        claimed = "%s.%d.claimed" % (entry, os.getpid())
+        try:
+            os.rename(entry, claimed)
+        except FileNotFoundError:
+            # Claimed by another renderer.
+            continue
+        try:
+            with open(claimed, "r") as claimed_file:
+                metadata = json.load(claimed_file)["metadata"]
+        finally:
+            os.remove(claimed)
+
+        metadata = os.path.abspath(os.path.join(path, metadata))
+        image = os.path.splitext(metadata)[0] + ".png"
+        if not os.path.exists(image):
+            image = get_content_addressed_image(metadata, path)
+        if image is not None:
+            screenshots[metadata] = {"image": image, "metadata": metadata}
+    return list(screenshots.values())
+
+def get_shard_key(screenshot, path):
+    """Gets a key for a screenshot which is the same on every machine,
+    regardless of where the screenshot folder is located.
+    """
+    relative = os.path.relpath(screenshot["metadata"], os.path.abspath(path))
+    return relative.replace(os.sep, "/")
+
+def estimate_cost(screenshot):
+    """Estimates the cost of rendering a screenshot as its number of pixels
+    times its number of tooltips.
+
+    Only the header of the image is read.
+    """
+    with Image.open(screenshot["image"]) as img:
+        pixels = img.width * img.height
+    metadata = load(screenshot["metadata"])
+    tooltips = sum(len(element.tooltips) for document in metadata.documents
+            for element in document.elements)
+    return pixels * max(tooltips, 1)
+
+def shard_screenshots(screenshots, index, count, path, weighted=False):
+    """Selects the screenshots to render in one of ``count`` shards.
+
+    The partitioning is deterministic, so separate machines given the same
+    screenshots and different indices render every screenshot exactly once.
+
+    :param screenshots: Screenshots as returned by
+        :py:func:`~skald.webdoc.get_screenshots`.
+    :param index: The shard to select, from ``1`` to ``count``.
+    :param count: The total number of shards.
+    :param path: The screenshot folder.
+    :param weighted: If ``True``, screenshots are distributed so that the
+        estimated cost of each shard is balanced, see
+        :py:func:`~skald.webdoc.estimate_cost`. Otherwise they are
+        distributed by a hash of their path.
+    """
+    if not 1 <= index <= count:
+        raise ValueError("Shard index must be between 1 and %d, got %d" %
+                (count, index))
+    keyed = sorted(((get_shard_key(screenshot, path), screenshot)
+            for screenshot in screenshots), key=lambda x: x[0])
+
+    if not weighted:
+        def get_shard(key):
+            digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            return int(digest, 16) % count
+        return [screenshot for key, screenshot in keyed
+                if get_shard(key) == index - 1]
+
+    costs = [(estimate_cost(screenshot), key, screenshot)
+            for key, screenshot in keyed]
+    costs.sort(key=lambda x: (-x[0], x[1]))
+    loads = [0] * count
+    selected = []
+    for cost, key, screenshot in costs:
+        shard = loads.index(min(loads))
+        loads[shard] += cost
+        if shard == index - 1:
+            selected.append(screenshot)
+    return selected
@@ -0,0 +1,34 @@
+import io
+from unittest import TestCase
+
+from PIL import Image
+
+from skald.capture import capture_full_page
+from skald.testing import FakeWebDriver
+
+class TestCaptureFullPage(TestCase):
+    def setUp(self):
+        self.page = Image.linear_gradient("L").resize((40, 1000)).convert("RGB")
+
+    def capture(self, driver):
+        data = io.BytesIO()
+        size = capture_full_page(driver, data)
+        return size, Image.open(io.BytesIO(data.getvalue()))
+
+    def test_stitches_viewports(self):
+        driver = FakeWebDriver(height=300, page=self.page)
+        size, img = self.capture(driver)
+        self.assertEqual(size, (40, 1000))
+        self.assertEqual(img.tobytes(), self.page.tobytes())
+        self.assertEqual(driver.calls["get_screenshot_as_png"], 4)
+
+    def test_stitches_high_density_viewports(self):
+        driver = FakeWebDriver(height=150, page=self.page, ratio=2)
+        size, img = self.capture(driver)
+        self.assertEqual(img.tobytes(), self.page.tobytes())
+
+    def test_restores_scroll_position(self):
+        driver = FakeWebDriver(height=300, page=self.page)
+        driver.y = 120
+        self.capture(driver)
+        self.assertEqual(driver.y, 120)
@@ -0,0 +1,45 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from skald.configuration import read_configurations
+
+class TestProfiles(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, config):
+        with open(os.path.join(self.folder, "skald.json"), "w") as f:
+            json.dump(config, f)
+
+    def test_without_profiles(self):
+        self.write({"folder": "docs"})
+        configs = read_configurations(self.folder)
+        self.assertEqual(len(configs), 1)
+        self.assertEqual(configs[0].output_folder, "docs")
+        self.assertIsNone(configs[0].name)
+
+    def test_profiles_override_base(self):
+        self.write({
+            "folder": "docs",
+            "tooltip": {"padding": 3, "color": "ffffffaa"},
+            "profiles": {
+                "light": {},
+                "dark": {"tooltip": {"color": "000000aa"}},
+                "print": {"output_folder": "printed"},
+            },
+        })
+        configs = read_configurations(self.folder)
+        self.assertEqual([c.name for c in configs], ["dark", "light", "print"])
+        dark, light, printed = configs
+        self.assertEqual(dark.tooltip.padding, 3)
+        self.assertEqual(dark.tooltip.color, (0, 0, 0, 170))
+        self.assertEqual(light.tooltip.color, (255, 255, 255, 170))
+        self.assertEqual(dark.folder, "docs")
+        self.assertEqual(dark.output_folder, os.path.join("docs", "dark"))
+        self.assertEqual(printed.output_folder, "printed")
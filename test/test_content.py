@@ -0,0 +1,58 @@
+import random
+from unittest import TestCase
+
+from PIL import Image, ImageDraw
+
+from skald.configuration import Penalties
+from skald.content import ContentMap
+from skald.definitions import Element, Tooltip
+from skald.geometry import Size, Point, Rectangle
+from skald.positioning import get_box_position
+
+class TestContentMap(TestCase):
+    def test_matches_direct_sum(self):
+        rng = random.Random(1)
+        img = Image.new("L", (30, 20))
+        img.putdata([rng.randrange(256) for i in range(30 * 20)])
+        content = ContentMap.from_image(img)
+        pixels = img.load()
+
+        def strength(x, y):
+            value = 0
+            if x > 0:
+                value += abs(pixels[x, y] - pixels[x - 1, y])
+            if y > 0:
+                value += abs(pixels[x, y] - pixels[x, y - 1])
+            return min(value, 255)
+
+        for i in range(20):
+            left, right = sorted(rng.sample(range(31), 2))
+            top, bottom = sorted(rng.sample(range(21), 2))
+            expected = sum(strength(x, y) for x in range(left, right)
+                    for y in range(top, bottom)) / 255
+            self.assertAlmostEqual(content.get_busyness(
+                Rectangle(left, top, right, bottom)), expected)
+
+    def test_clips_to_image(self):
+        content = ContentMap.from_image(Image.new("RGB", (10, 10), "white"))
+        self.assertEqual(content.get_busyness(Rectangle(-5, -5, 20, 20)), 0)
+
+class TestContentPenalty(TestCase):
+    def test_avoids_busy_content(self):
+        img = Image.new("RGB", (200, 200), "white")
+        draw = ImageDraw.Draw(img)
+        # Stripes above the element.
+        for y in range(0, 80, 2):
+            draw.line((0, y, 200, y), fill="black")
+        content = ContentMap.from_image(img)
+        element = Element(location=Point(80, 90), size=Size(40, 20))
+        tooltip = Tooltip("Text", positions="over under",
+                alignments="center")
+
+        def best(penalties):
+            choices = get_box_position(element, tooltip, Size(40, 20),
+                    Rectangle(0, 0, 200, 200), 5, [], penalties, content)
+            return choices[0].rectangle.top
+
+        self.assertLess(best(Penalties(content=0)), 90)
+        self.assertGreater(best(Penalties(content=1)), 90)
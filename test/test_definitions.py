@@ -0,0 +1,133 @@
+import os
+import json
+import tempfile
+from unittest import TestCase
+
+from skald.definitions import (Screenshot, Document, SaveResult, save,
+        load, ScreenshotEncoder)
+from skald.geometry import Point, Size
+from skald.testing import FakeWebDriver
+from skald.webdoc import claim_screenshots, get_screenshots
+
+class TestSaveContentAddressed(TestCase):
+    def test_stores_identical_images_once(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder, "content_addressed": True},
+                        config_file)
+            driver = FakeWebDriver(width=20, height=10)
+            first = Screenshot("first", "flow1")
+            second = Screenshot("second", "flow2")
+            save(first, driver, config_path)
+            save(second, driver, config_path)
+
+            self.assertEqual(first.image_hash, second.image_hash)
+            self.assertEqual(first.image_path, second.image_path)
+            with open(os.path.join(folder, first.image_path), "rb") as f:
+                self.assertEqual(f.read(), driver.get_screenshot_as_png())
+
+class TestSave(TestCase):
+    def test_skips_unchanged_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": os.path.join(folder, "skald")},
+                        config_file)
+
+            screenshot = Screenshot("page", "flow")
+            first = save(screenshot, FakeWebDriver(png=b"image"), config_path)
+            second = save(screenshot, FakeWebDriver(png=b"image"), config_path)
+            screenshot.add_document(Document("document"))
+            third = save(screenshot, FakeWebDriver(png=b"image"), config_path)
+
+        self.assertEqual(first, SaveResult(True, True))
+        self.assertEqual(second, SaveResult(False, False))
+        self.assertEqual(third, SaveResult(False, True))
+
+    def test_replaces_changed_image_without_leaving_temporary_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder}, config_file)
+
+            screenshot = Screenshot("page", "")
+            save(screenshot, FakeWebDriver(png=b"image"), config_path)
+            result = save(screenshot, FakeWebDriver(png=b"other"), config_path)
+            self.assertEqual(result, SaveResult(True, False))
+            with open(os.path.join(folder, "page.png"), "rb") as f:
+                self.assertEqual(f.read(), b"other")
+            self.assertEqual(sorted(os.listdir(folder)),
+                    ["page.json", "page.png", "skald.json"])
+
+    def test_streams_content_addressed_image(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder, "content_addressed": True},
+                        config_file)
+
+            first = Screenshot("first", "")
+            second = Screenshot("second", "")
+            self.assertTrue(save(first, FakeWebDriver(png=b"image"),
+                config_path).image_written)
+            self.assertFalse(save(second, FakeWebDriver(png=b"image"),
+                config_path).image_written)
+            self.assertEqual(first.image_path, second.image_path)
+            with open(os.path.join(folder, first.image_path), "rb") as f:
+                self.assertEqual(f.read(), b"image")
+            self.assertFalse([name for name in os.listdir(folder)
+                if name.endswith(".tmp")])
+
+    def test_registers_captures_in_spool(self):
+        with tempfile.TemporaryDirectory() as folder:
+            skald_folder = os.path.join(folder, "skald")
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": skald_folder, "spool": True},
+                        config_file)
+
+            screenshot = Screenshot("page", "flow")
+            save(screenshot, FakeWebDriver(png=b"image"), config_path)
+            save(screenshot, FakeWebDriver(png=b"image"), config_path)
+            save(Screenshot("other", "flow"), FakeWebDriver(png=b"image"),
+                    config_path)
+
+            claimed = claim_screenshots(skald_folder)
+            self.assertEqual([os.path.basename(s["metadata"])
+                for s in claimed], ["page.json", "other.json"])
+            self.assertEqual(claim_screenshots(skald_folder), [])
+            self.assertEqual(len(get_screenshots(skald_folder)), 2)
+            self.assertEqual(sorted(os.listdir(os.path.join(skald_folder,
+                "flow"))), ["other.json", "other.png", "page.json",
+                    "page.png"])
+
+class TestLayoutSnapshot(TestCase):
+    def test_resolves_selectors_offline(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder, "layout_snapshot": True},
+                        config_file)
+            driver = FakeWebDriver(width=20, height=20)
+            driver.create_elements(2, width=4, height=3)
+
+            screenshot = Screenshot("page", "")
+            save(screenshot, driver, config_path)
+            self.assertEqual(driver.calls["execute_script"], 1)
+
+            document = Document("document")
+            document.add_element("#element1", tooltip="Second")
+            screenshot.add_document(document)
+            meta_path = os.path.join(folder, screenshot.meta_path)
+            with open(meta_path, "w") as meta_file:
+                json.dump(screenshot, meta_file, cls=ScreenshotEncoder)
+
+            element = load(meta_path).documents[0].elements[0]
+            self.assertEqual(element.location, Point(18, 10))
+            self.assertEqual(element.size, Size(4, 3))
+
+            document.add_element("#missing")
+            with open(meta_path, "w") as meta_file:
+                json.dump(screenshot, meta_file, cls=ScreenshotEncoder)
+            self.assertRaises(ValueError, load, meta_path)
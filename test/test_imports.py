@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+CAPTURE_MODULES = ["skald.definitions", "skald.configuration",
+        "skald.geometry", "skald.testing"]
+
+class TestCaptureImports(TestCase):
+    def get_imported_modules(self, module):
+        code = "import sys, %s; print('\\n'.join(sys.modules))" % module
+        output = subprocess.check_output([sys.executable, "-c", code],
+                universal_newlines=True)
+        return output.split("\n")
+
+    def test_capture_does_not_import_rendering(self):
+        for module in CAPTURE_MODULES:
+            modules = self.get_imported_modules(module)
+            self.assertNotIn("PIL", modules, module)
+            self.assertNotIn("skald.webdoc", modules, module)
+            self.assertNotIn("skald.text", modules, module)
@@ -0,0 +1,32 @@
+import os
+import json
+import tempfile
+from unittest import TestCase, mock
+
+from skald.definitions import Screenshot, Document, save
+from skald.main import render, run
+from skald.testing import FakeWebDriver
+from skald.webdoc import claim_screenshots
+
+class TestRender(TestCase):
+    def test_claims_spooled_screenshots(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder, "spool": True}, config_file)
+            driver = FakeWebDriver(width=30, height=20)
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(Document("first"))
+            save(screenshot, driver, config_path)
+
+            render(config_path)
+            self.assertTrue(os.path.exists(os.path.join(folder, "first.png")))
+            self.assertEqual(claim_screenshots(folder), [])
+
+    def test_rejects_shard_with_archive_or_sprites(self):
+        self.assertRaises(ValueError, render, shard=(1, 2), sprites=True)
+        self.assertRaises(ValueError, render, shard=(1, 2),
+                archive="documents.zip")
+        with mock.patch("sys.stderr"):
+            self.assertRaises(SystemExit, run, ["--shard", "1/2",
+                "--sprites"])
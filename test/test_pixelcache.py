@@ -0,0 +1,53 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from skald.definitions import hash_file
+from skald.pixelcache import PixelCache
+
+class TestPixelCache(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = PixelCache(os.path.join(self.folder.name, "cache"))
+        self.path = os.path.join(self.folder.name, "screenshot.png")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_maps_cached_pixels(self):
+        img = Image.linear_gradient("L").convert("RGB").resize((30, 20))
+        img.save(self.path)
+        first = self.cache.get(self.path)
+        second = self.cache.get(self.path)
+        self.assertTrue(second.readonly)
+        self.assertEqual(second.convert("RGB").tobytes(), img.tobytes())
+        self.assertEqual(first.size, second.size)
+
+    def test_invalidated_by_content(self):
+        Image.new("L", (10, 10), 0).save(self.path)
+        self.assertEqual(self.cache.get(self.path).getpixel((0, 0)), 0)
+        Image.new("L", (10, 10), 200).save(self.path)
+        self.assertEqual(self.cache.get(self.path).getpixel((0, 0)), 200)
+
+    def test_removes_least_recently_used_entries(self):
+        cache = PixelCache(self.cache.folder, max_size=2 * (32 + 100))
+        paths = []
+        for value in range(3):
+            path = os.path.join(self.folder.name, "%d.png" % value)
+            Image.new("L", (10, 10), value).save(path)
+            paths.append(path)
+        cache.get(paths[0])
+        cache.get(paths[1])
+        # Used again, so the second is the least recently used.
+        entry = cache.get_entry_path(hash_file(paths[0]))
+        os.utime(entry, (0, 0))
+        os.utime(cache.get_entry_path(hash_file(paths[1])), (0, 0))
+        cache.get(paths[0])
+        cache.get(paths[2])
+        self.assertTrue(os.path.exists(entry))
+        self.assertFalse(os.path.exists(cache.get_entry_path(
+            hash_file(paths[1]))))
+        self.assertTrue(os.path.exists(cache.get_entry_path(
+            hash_file(paths[2]))))
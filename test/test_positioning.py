@@ -1,5 +1,8 @@
+import random
+from itertools import product
 from unittest import TestCase
-from skald.positioning import adjust_x_position, adjust_y_position, Choice
+from skald.positioning import (adjust_x_position, adjust_y_position, Choice,
+        solve_placement)
 from skald.geometry import Size, Rectangle
 
 class TestAdjustXPosition(TestCase):
@@ -35,3 +38,45 @@ class TestAdjustYPosition(TestCase):
         point = adjust_y_position(rectangle, bounds, margin)
         self.assertEqual(point.x, 0)
         self.assertEqual(point.y, -110)
+
+class TestSolvePlacement(TestCase):
+    def brute_force(self, choice_lists):
+        best = None
+        for combination in product(*choice_lists):
+            overlap = any(a.rectangle in b.rectangle
+                    for i, a in enumerate(combination)
+                    for b in combination[i+1:])
+            if overlap:
+                continue
+            penalty = sum(choice.penalty for choice in combination)
+            if best is None or penalty < best:
+                best = penalty
+        return best
+
+    def random_choices(self, rng):
+        choices = []
+        for i in range(rng.randint(1, 5)):
+            left, top = rng.randint(0, 50), rng.randint(0, 50)
+            rectangle = Rectangle(left, top, left + 10, top + 10)
+            choices.append(Choice(rectangle=rectangle,
+                penalty=rng.randint(0, 20)))
+        choices.sort(key=lambda x: x.penalty)
+        return choices
+
+    def test_matches_exhaustive_search(self):
+        rng = random.Random(0)
+        for i in range(200):
+            choice_lists = [self.random_choices(rng)
+                    for j in range(rng.randint(1, 4))]
+            selected = solve_placement(choice_lists)
+            expected = self.brute_force(choice_lists)
+            if expected is None:
+                self.assertIsNone(selected)
+            else:
+                self.assertEqual(sum(c.penalty for c in selected), expected)
+                for a, b in product(selected, selected):
+                    if a is not b:
+                        self.assertNotIn(a.rectangle, b.rectangle)
+
+    def test_no_tooltips(self):
+        self.assertEqual(solve_placement([]), [])
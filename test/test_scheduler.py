@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from skald.scheduler import (MemoryScheduler, prefetch, estimate_memory,
+        BYTES_PER_PIXEL, CONTENT_MAP_BYTES_PER_PIXEL)
+
+class TestMemoryScheduler(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def job(self, cost):
+        with self.lock:
+            self.running += cost
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= cost
+        return cost
+
+    def test_stays_within_budget(self):
+        scheduler = MemoryScheduler(budget=10, workers=8)
+        costs = [3, 3, 3, 4, 2, 5, 1, 1]
+        results = scheduler.run((cost, self.job, (cost,)) for cost in costs)
+        self.assertEqual(results, costs)
+        self.assertLessEqual(self.peak, 10)
+        self.assertGreater(self.peak, 5)
+
+    def test_runs_large_jobs_alone(self):
+        scheduler = MemoryScheduler(budget=10, workers=8)
+        costs = [1, 20, 1, 20]
+        scheduler.run((cost, self.job, (cost,)) for cost in costs)
+        self.assertEqual(self.peak, 20)
+
+    def test_counts_results_until_consumed(self):
+        scheduler = MemoryScheduler(budget=10, workers=8)
+
+        def job(cost):
+            # The result is alive from when the job starts until the
+            # consumer is done with it.
+            with self.lock:
+                self.running += cost
+                self.peak = max(self.peak, self.running)
+            return cost
+
+        for cost in scheduler.iterate((5, job, (5,)) for i in range(20)):
+            time.sleep(0.005)
+            with self.lock:
+                self.running -= cost
+        self.assertLessEqual(self.peak, 10)
+        self.assertEqual(scheduler.used, 0)
+
+class TestPrefetch(TestCase):
+    def test_keeps_order(self):
+        self.assertEqual(list(prefetch(lambda x: x * 2, range(10), depth=3)),
+                [x * 2 for x in range(10)])
+
+    def test_raises_errors(self):
+        def fail(x):
+            if x == 2:
+                raise ValueError(x)
+            return x
+        results = prefetch(fail, range(5))
+        self.assertEqual(next(results), 0)
+        self.assertEqual(next(results), 1)
+        self.assertRaises(ValueError, next, results)
+
+class TestEstimateMemory(TestCase):
+    def test_counts_documents_and_content_map(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "page.png")
+            Image.new("RGB", (10, 20)).save(path)
+            self.assertEqual(estimate_memory(path, 2),
+                    3 * 200 * BYTES_PER_PIXEL)
+            self.assertEqual(estimate_memory(path, 2, content=True),
+                    3 * 200 * BYTES_PER_PIXEL
+                    + 200 * CONTENT_MAP_BYTES_PER_PIXEL)
@@ -0,0 +1,130 @@
+import io
+import os
+import json
+import base64
+import shutil
+import socket
+import tempfile
+import threading
+import http.client
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen, Request
+
+from PIL import Image
+
+from skald.definitions import Screenshot, Document, ScreenshotEncoder
+from skald.server import RenderServer, Worker
+
+class TestRenderServer(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        with open(os.path.join(self.folder, "skald.json"), "w") as f:
+            json.dump({"folder": self.folder}, f)
+        self.image = os.path.join(self.folder, "page.png")
+        Image.new("RGB", (40, 30), (0, 0, 255)).save(self.image)
+        screenshot = Screenshot("page", "")
+        screenshot.add_document(Document("first"), Document("second"))
+        self.screenshot = json.loads(json.dumps(screenshot,
+            cls=ScreenshotEncoder))
+        self.server = RenderServer(self.folder, port=0, processes=1)
+        self.url = "http://%s:%d" % self.server.address
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.folder)
+
+    def post(self, jobs, headers=None):
+        data = json.dumps(jobs).encode("utf-8")
+        if headers is None:
+            headers = {"Content-Type": "application/json"}
+        request = Request(self.url + "/render", data, headers)
+        with urlopen(request) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def get_status(self, jobs, headers):
+        try:
+            self.post(jobs, headers)
+        except HTTPError as e:
+            return e.code
+        return 200
+
+    def test_renders_inline_screenshot_to_bytes(self):
+        result = self.post({"screenshot": self.screenshot,
+            "image": self.image, "documents": ["first"], "output": "bytes"})
+        self.assertEqual(list(result["documents"]), ["first.png"])
+        data = base64.b64decode(result["documents"]["first.png"])
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (40, 30))
+
+    def test_batch_keeps_order_and_reports_errors(self):
+        results = self.post([
+            {"screenshot": self.screenshot, "image": self.image},
+            {"metadata": os.path.join(self.folder, "missing.json")},
+        ])
+        self.assertEqual(sorted(results[0]["documents"]),
+                ["first.png", "second.png"])
+        self.assertTrue(os.path.exists(results[0]["documents"]["first.png"]))
+        self.assertIn("error", results[1])
+
+    def test_rejects_cross_origin_and_form_posts(self):
+        job = {"screenshot": self.screenshot, "image": self.image}
+        self.assertEqual(self.get_status(job, {
+            "Content-Type": "application/json",
+            "Origin": "http://example.com"}), 403)
+        self.assertEqual(self.get_status(job, {
+            "Content-Type": "text/plain"}), 415)
+        self.assertEqual(self.get_status(job, {
+            "Content-Type": "application/json; charset=utf-8"}), 200)
+
+    def test_rejects_paths_outside_folders(self):
+        outside = dict(self.screenshot, name="../../outside")
+        results = self.post([
+            {"metadata": os.path.join(self.folder, "..", "page.json")},
+            {"screenshot": self.screenshot, "image": "/etc/passwd"},
+            {"screenshot": outside, "image": self.image},
+        ])
+        for result in results:
+            self.assertIn("outside", result["error"])
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+class TestUnixSocket(TestCase):
+    def test_serves_on_unix_socket(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "skald.sock")
+            server = RenderServer(folder, socket=path, processes=1)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                connection = UnixHTTPConnection(path)
+                connection.request("GET", "/health")
+                response = connection.getresponse()
+                self.assertEqual(json.loads(response.read().decode("utf-8")),
+                        {"status": "ok"})
+                connection.close()
+            finally:
+                server.shutdown()
+                thread.join()
+            self.assertFalse(os.path.exists(path))
+
+class TestWorkerProfiles(TestCase):
+    def test_job_must_name_profile(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with open(os.path.join(folder, "skald.json"), "w") as f:
+                json.dump({"folder": folder,
+                    "profiles": {"light": {}, "dark": {}}}, f)
+            worker = Worker(folder)
+            self.assertRaises(ValueError, worker.get_configuration, {})
+            self.assertEqual(worker.get_configuration(
+                {"profile": "dark"}).name, "dark")
@@ -0,0 +1,83 @@
+import io
+import os
+import json
+import random
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from PIL import Image
+
+from skald.configuration import Configuration, Variant
+from skald.sinks import (MemorySink, ArchiveSink, ThreadedSink, SpriteSink,
+        pack_shelves)
+
+class TestSinks(TestCase):
+    def setUp(self):
+        self.config = Configuration(variants=[Variant(),
+            Variant(suffix="@2x", scale=2)])
+        self.img = Image.new("RGB", (20, 20))
+
+    def test_memory_sink_collects_variants(self):
+        sink = MemorySink()
+        sink.write("shots/document.png", self.img, self.config)
+        sink.close()
+        self.assertEqual(list(sink.documents),
+                ["shots/document@2x.png", "shots/document.png"])
+        img = Image.open(io.BytesIO(sink.documents["shots/document.png"]))
+        self.assertEqual(img.size, (10, 10))
+
+    def test_archive_sink_streams_zip(self):
+        data = io.BytesIO()
+        sink = ArchiveSink(data, format="zip")
+        sink.write("shots/document.png", self.img, self.config)
+        sink.close()
+        archive = zipfile.ZipFile(io.BytesIO(data.getvalue()))
+        self.assertEqual(sorted(archive.namelist()),
+                ["shots/document.png", "shots/document@2x.png"])
+
+    def test_threaded_sink_writes_behind(self):
+        memory = MemorySink()
+        sink = ThreadedSink(memory, depth=2)
+        names = sink.write("document.png", self.img, self.config)
+        sink.write("other.png", self.img, self.config)
+        sink.close()
+        self.assertEqual(names, ["document.png", "document@2x.png"])
+        self.assertEqual(len(memory.documents), 4)
+
+    def test_sprite_sink_packs_folders(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = SpriteSink(folder, max_width=30)
+            sink.write("shots/first.png", self.img, self.config)
+            sink.write("shots/second.png", Image.new("RGB", (10, 30)),
+                    self.config)
+            sink.write("other/third.png", self.img, self.config)
+            sink.close()
+
+            with open(os.path.join(folder, "shots", "sprites.map.json")) as f:
+                sprites = json.load(f)
+            # The variant without suffix is at half the rendered scale.
+            self.assertEqual(sprites["sprites"]["second"],
+                    {"x": 0, "y": 0, "width": 5, "height": 15})
+            self.assertEqual(sprites["sprites"]["first"],
+                    {"x": 5, "y": 0, "width": 10, "height": 10})
+            sheet = Image.open(os.path.join(folder, "shots", "sprites.png"))
+            self.assertEqual(sheet.size, (15, 15))
+            self.assertTrue(os.path.exists(os.path.join(folder, "shots",
+                "sprites@2x.css")))
+            self.assertTrue(os.path.exists(os.path.join(folder, "other",
+                "sprites.png")))
+
+class TestPackShelves(TestCase):
+    def test_does_not_overlap(self):
+        rng = random.Random(3)
+        sizes = [(rng.randint(1, 40), rng.randint(1, 40)) for i in range(50)]
+        positions, size = pack_shelves(sizes, 100)
+        rectangles = [(x, y, x + w, y + h)
+                for (x, y), (w, h) in zip(positions, sizes)]
+        for i, a in enumerate(rectangles):
+            self.assertLessEqual(a[2], size[0])
+            self.assertLessEqual(a[3], size[1])
+            for b in rectangles[i + 1:]:
+                self.assertFalse(a[0] < b[2] and b[0] < a[2] and
+                        a[1] < b[3] and b[1] < a[3])
@@ -0,0 +1,43 @@
+import os
+import json
+import tempfile
+from unittest import TestCase, skipUnless
+
+from PIL import Image
+
+from skald.definitions import Screenshot, ScreenshotEncoder, Document
+
+try:
+    from sphinx.application import Sphinx
+except ImportError:
+    Sphinx = None
+
+@skipUnless(Sphinx, "Sphinx is not installed")
+class TestSkaldDocumentDirective(TestCase):
+    def test_depends_on_metadata_screenshot_and_configuration(self):
+        with tempfile.TemporaryDirectory() as folder:
+            shots = os.path.join(folder, "shots")
+            os.mkdir(shots)
+            Image.new("RGB", (30, 20), (0, 0, 255)).save(
+                    os.path.join(shots, "page.png"))
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(Document("first"))
+            with open(os.path.join(shots, "page.json"), "w") as f:
+                json.dump(screenshot, f, cls=ScreenshotEncoder)
+            with open(os.path.join(folder, "skald.json"), "w") as f:
+                json.dump({"folder": "shots"}, f)
+            with open(os.path.join(folder, "conf.py"), "w") as f:
+                f.write("extensions = ['skald.sphinx']\n")
+            with open(os.path.join(folder, "index.rst"), "w") as f:
+                f.write("Page\n====\n\n.. skald-document:: page first\n")
+
+            app = Sphinx(folder, folder, os.path.join(folder, "_build"),
+                    os.path.join(folder, "_doctrees"), "html", status=None,
+                    warning=None, freshenv=True)
+            app.build()
+
+            dependencies = set(os.path.normpath(os.path.join(folder, path))
+                    for path in app.env.dependencies["index"])
+            for path in ("shots/page.json", "shots/page.png", "skald.json"):
+                self.assertIn(os.path.normpath(os.path.join(folder, path)),
+                        dependencies)
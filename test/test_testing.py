@@ -0,0 +1,27 @@
+import io
+from unittest import TestCase
+
+from PIL import Image
+
+from skald.definitions import Document
+from skald.testing import FakeWebDriver
+
+class TestFakeWebDriver(TestCase):
+    def test_screenshot_has_viewport_size(self):
+        driver = FakeWebDriver(width=64, height=48)
+        img = Image.open(io.BytesIO(driver.get_screenshot_as_png()))
+        self.assertEqual(img.size, (64, 48))
+        self.assertEqual(driver.calls["get_screenshot_as_png"], 1)
+
+    def test_counts_element_round_trips(self):
+        driver = FakeWebDriver()
+        elements = driver.create_elements(3)
+        self.assertEqual(driver.round_trips, 0)
+        document = Document("document")
+        document.add_element(*elements)
+        element = document.elements[1]
+        self.assertEqual((element.location.x, element.location.y), (250, 10))
+        self.assertEqual((element.size.width, element.size.height), (120, 30))
+        self.assertGreater(driver.round_trips, 0)
+        self.assertEqual(driver.round_trips, sum(driver.calls[name]
+            for name in ("location", "size", "rect")))
@@ -0,0 +1,102 @@
+import os
+import json
+import tempfile
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from skald.definitions import Screenshot, Document, ScreenshotEncoder
+from skald import watch
+from skald.watch import Watcher
+
+class WatcherTestCase(TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.folder = self.temp.name
+        self.shots = os.path.join(self.folder, "shots")
+        os.makedirs(os.path.join(self.shots, "flow"))
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write_config(self, config):
+        config.setdefault("folder", self.shots)
+        with open(os.path.join(self.folder, "skald.json"), "w") as f:
+            json.dump(config, f)
+
+    def write_screenshot(self, name, documents, color=(0, 0, 255),
+            image=True):
+        if image:
+            Image.new("RGB", (30, 20), color).save(
+                    os.path.join(self.shots, "flow", "%s.png" % name))
+        screenshot = Screenshot(name, "flow")
+        screenshot.add_document(*[Document(document)
+            for document in documents])
+        with open(os.path.join(self.shots, "flow", "%s.json" % name),
+                "w") as f:
+            json.dump(screenshot, f, cls=ScreenshotEncoder)
+
+    def touch(self, path):
+        # Modification times may not change between quick writes.
+        mtime = os.path.getmtime(path) + 1
+        os.utime(path, (mtime, mtime))
+
+class TestWatcherUpdate(WatcherTestCase):
+    def setUp(self):
+        WatcherTestCase.setUp(self)
+        self.write_config({})
+        self.write_screenshot("first", ["one", "two"])
+        self.write_screenshot("second", ["three"])
+        self.watcher = Watcher(self.folder)
+        self.watcher.poll()
+        self.watcher.render_all()
+
+    def update(self):
+        """Updates the watcher, returning the names of the documents
+        rendered.
+        """
+        with mock.patch.object(watch, "process_document",
+                wraps=watch.process_document) as process_document:
+            self.watcher.update()
+        return sorted(call[1]["document"].name
+                for call in process_document.call_args_list)
+
+    def test_renders_nothing_without_changes(self):
+        self.assertEqual(self.update(), [])
+
+    def test_renders_only_changed_documents(self):
+        self.write_screenshot("first", ["one", "two", "four"], image=False)
+        self.touch(os.path.join(self.shots, "flow", "first.json"))
+        self.assertEqual(self.update(), ["four"])
+
+    def test_renders_every_document_of_changed_image(self):
+        self.touch(os.path.join(self.shots, "flow", "first.png"))
+        self.assertEqual(self.update(), ["one", "two"])
+
+    def test_renders_everything_after_configuration_change(self):
+        output_folder = os.path.join(self.folder, "out")
+        self.write_config({"output_folder": output_folder})
+        self.touch(os.path.join(self.folder, "skald.json"))
+        self.update()
+        for name in ("one", "two", "three"):
+            self.assertTrue(os.path.exists(os.path.join(output_folder,
+                "flow", "%s.png" % name)))
+        self.assertEqual(self.update(), [])
+
+    def test_keeps_only_changed_images_in_memory(self):
+        self.assertEqual(len(self.watcher.images), 0)
+        self.touch(os.path.join(self.shots, "flow", "first.png"))
+        self.update()
+        self.assertEqual(len(self.watcher.images), 1)
+
+class TestWatcherProfiles(WatcherTestCase):
+    def test_renders_every_profile_into_new_folders(self):
+        self.write_config({"output_folder": os.path.join(self.folder, "out"),
+            "profiles": {"light": {}, "dark": {}}})
+        self.write_screenshot("page", ["one"])
+        watcher = Watcher(self.folder)
+        watcher.poll()
+        watcher.render_all()
+        for profile in ("light", "dark"):
+            self.assertTrue(os.path.exists(os.path.join(self.folder, "out",
+                profile, "flow", "one.png")))
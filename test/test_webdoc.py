@@ -0,0 +1,373 @@
+import io
+import os
+import json
+import tempfile
+from unittest import TestCase, mock
+
+from PIL import Image, ImageChops
+
+from skald import webdoc
+from skald.configuration import Configuration, Tooltip, Variant, Penalties
+from skald.geometry import Size, Point, Rectangle
+from skald.text import TextArea, TextAlign
+from skald.definitions import (Screenshot, ScreenshotEncoder, Element,
+        Document, save)
+from skald.testing import FakeWebDriver
+from skald.positioning import Choice
+from skald.webdoc import (draw_textarea, save_variants, load_image,
+        get_screenshots, shard_screenshots, PatchCache, seed_placement,
+        save_patches, restore_patches, can_draw_in_place, render_cached,
+        render_profiles, process_screenshots, place_screenshot)
+from skald.sinks import MemorySink
+
+class TestDrawTextarea(TestCase):
+    def setUp(self):
+        self.config = Configuration(tooltip=Tooltip(color="ff000080"))
+        self.textarea = TextArea(text=[], wrapper=Size(10, 10),
+                line_sizes=[], line_spacing=0, padding=5,
+                align=TextAlign.center)
+        self.textarea.position = Point(10, 10)
+
+    def test_blends_translucent_tooltip_on_rgb(self):
+        img = Image.new("RGB", (50, 50), (0, 0, 255))
+        draw_textarea(img, self.textarea, self.config)
+        red, green, blue = img.getpixel((15, 15))
+        self.assertAlmostEqual(red, 128, delta=1)
+        self.assertAlmostEqual(blue, 127, delta=1)
+        self.assertEqual(img.getpixel((5, 5)), (0, 0, 255))
+
+    def test_blends_translucent_tooltip_on_rgba(self):
+        img = Image.new("RGBA", (50, 50), (0, 0, 255, 255))
+        draw_textarea(img, self.textarea, self.config)
+        red, green, blue, alpha = img.getpixel((29, 29))
+        self.assertAlmostEqual(red, 128, delta=1)
+        self.assertEqual(alpha, 255)
+        self.assertEqual(img.getpixel((30, 30)), (0, 0, 255, 255))
+
+    def test_restores_pixels_under_tooltip(self):
+        img = Image.linear_gradient("L").resize((50, 50)).convert("RGB")
+        original = img.copy()
+        self.textarea.position = Point(10.4, 9.6)
+        saved = save_patches(img, [self.textarea])
+        draw_textarea(img, self.textarea, self.config)
+        self.assertNotEqual(img.tobytes(), original.tobytes())
+        restore_patches(img, saved)
+        self.assertEqual(img.tobytes(), original.tobytes())
+
+    def test_draws_in_place_only_on_whole_writable_image(self):
+        img = Image.new("RGB", (50, 50))
+        self.assertTrue(can_draw_in_place(img, Rectangle(0, 0, 50, 50)))
+        self.assertFalse(can_draw_in_place(img, Rectangle(0, 0, 40, 50)))
+        self.assertFalse(can_draw_in_place("image.png",
+            Rectangle(0, 0, 50, 50)))
+
+class TestSaveVariants(TestCase):
+    def test_saves_reduced_variants(self):
+        config = Configuration(variants=[
+            Variant(suffix="@2x", scale=2),
+            Variant(scale=1),
+            Variant(suffix="-thumbnail", scale=1, max_width=20,
+                format="jpeg"),
+        ])
+        img = Image.new("RGBA", (200, 100), (255, 0, 0, 255))
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, "document.png")
+            paths = save_variants(img, output, config)
+            sizes = {os.path.basename(p): Image.open(p).size for p in paths}
+        self.assertEqual(sizes, {
+            "document@2x.png": (200, 100),
+            "document.png": (100, 50),
+            "document-thumbnail.jpg": (20, 10),
+        })
+
+class TestLoadImage(TestCase):
+    def test_decodes_only_rows_needed_for_crop(self):
+        img = Image.linear_gradient("L").resize((50, 1000))
+        crop = Rectangle(left=10, top=100, right=40, bottom=200)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "screenshot.png")
+            img.save(path)
+            cropped = load_image(path, crop)
+        self.assertEqual(cropped.size, (30, 100))
+        self.assertEqual(cropped.tobytes(), img.crop(crop).tobytes())
+
+    def test_decodes_shared_image_down_to_lowest_crop(self):
+        with tempfile.TemporaryDirectory() as folder:
+            Image.linear_gradient("L").resize((50, 1000)).save(
+                    os.path.join(folder, "page.png"))
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(
+                    Document("top", crop=Rectangle(0, 0, 50, 100)),
+                    Document("lower", crop=Rectangle(10, 150, 40, 300)))
+            meta_path = os.path.join(folder, "page.json")
+            with open(meta_path, "w") as f:
+                json.dump(screenshot, f, cls=ScreenshotEncoder)
+            metadata, base_image, placed = place_screenshot({
+                "metadata": meta_path,
+                "image": os.path.join(folder, "page.png")}, Configuration(
+                    folder=folder))
+            self.assertEqual(base_image.size, (50, 300))
+            self.assertEqual(len(placed), 2)
+
+class TestShardScreenshots(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        for i in range(10):
+            screenshot = Screenshot("screenshot%d" % i, "")
+            path = os.path.join(self.folder.name, screenshot.name)
+            Image.new("L", (10, 10 * (i + 1))).save(path + ".png")
+            with open(path + ".json", "w") as json_file:
+                json.dump(screenshot, json_file, cls=ScreenshotEncoder)
+        self.screenshots = get_screenshots(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def get_shards(self, weighted):
+        shards = [shard_screenshots(self.screenshots, i, 3,
+            self.folder.name, weighted=weighted) for i in range(1, 4)]
+        return [sorted(s["metadata"] for s in shard) for shard in shards]
+
+    def test_shards_partition_screenshots(self):
+        for weighted in (False, True):
+            shards = self.get_shards(weighted)
+            metadata = sorted(m for shard in shards for m in shard)
+            self.assertEqual(metadata,
+                    sorted(s["metadata"] for s in self.screenshots))
+            self.assertEqual(shards, self.get_shards(weighted))
+
+class TestPatchCache(TestCase):
+    def get_textarea(self, text):
+        return TextArea(text=[text], wrapper=Size(10, 10),
+                line_sizes=[Size(10, 10)], line_spacing=0, padding=5,
+                align=TextAlign.center)
+
+    def test_reuses_identical_tooltips(self):
+        config = Configuration()
+        cache = PatchCache()
+        first = cache.get(self.get_textarea("a"), config)
+        self.assertIs(cache.get(self.get_textarea("a"), config), first)
+        self.assertIsNot(cache.get(self.get_textarea("b"), config), first)
+
+    def test_stores_patches_on_disk(self):
+        config = Configuration()
+        with tempfile.TemporaryDirectory() as folder:
+            patch = PatchCache(folder=folder).get(self.get_textarea("a"),
+                    config)
+            cached = PatchCache(folder=folder).get(self.get_textarea("a"),
+                    config)
+        self.assertEqual(cached.tobytes(), patch.tobytes())
+
+class TestSeedPlacement(TestCase):
+    def get_textarea(self, text, element, offsets):
+        textarea = TextArea(text=[text], wrapper=Size(10, 10),
+                line_sizes=[Size(10, 10)], line_spacing=0, padding=0,
+                align=TextAlign.center)
+        textarea.choices = [Choice(rectangle=Rectangle.from_sizes(
+            size=Size(10, 10), position=element.location + Point(*offset)),
+            penalty=i) for i, offset in enumerate(offsets)]
+        return textarea
+
+    def test_keeps_relative_positions(self):
+        element = Element(location=Point(100, 100), size=Size(10, 10))
+        textarea = self.get_textarea("a", element, [(0, -20), (0, 20)])
+        previous = [{"lines": ["a"], "offset": [0, 20]}]
+        self.assertTrue(seed_placement([textarea], [element], previous))
+        self.assertEqual(textarea.position, Point(100, 120))
+
+    def test_repairs_conflicting_textareas(self):
+        first = Element(location=Point(100, 100), size=Size(10, 10))
+        second = Element(location=Point(100, 140), size=Size(10, 10))
+        textareas = [
+            self.get_textarea("a", first, [(0, -20), (0, 20)]),
+            self.get_textarea("b", second, [(0, -20), (0, 20)]),
+        ]
+        previous = [
+            {"lines": ["a"], "offset": [0, 20]},
+            {"lines": ["b"], "offset": [0, -20]},
+        ]
+        self.assertTrue(seed_placement(textareas, [first, second], previous))
+        self.assertEqual(textareas[0].position, Point(100, 120))
+        self.assertEqual(textareas[1].position, Point(100, 160))
+
+class TestRenderCached(TestCase):
+    def test_renders_changed_documents_only(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = Configuration(folder=folder)
+            Image.new("RGB", (30, 20), (0, 0, 255)).save(
+                    os.path.join(folder, "page.png"))
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(Document("first"), Document("second",
+                crop=Rectangle(0, 0, 10, 10)))
+            meta_path = os.path.join(folder, "page.json")
+            with open(meta_path, "w") as f:
+                json.dump(screenshot, f, cls=ScreenshotEncoder)
+            cache = os.path.join(folder, "cache")
+
+            first = render_cached(meta_path, "first", config, cache)
+            second = render_cached(meta_path, "second", config, cache)
+            self.assertEqual(Image.open(first).size, (30, 20))
+            self.assertEqual(Image.open(second).size, (10, 10))
+            mtime = os.path.getmtime(first)
+            self.assertEqual(render_cached(meta_path, "first", config, cache),
+                    first)
+            self.assertEqual(os.path.getmtime(first), mtime)
+            self.assertRaises(ValueError, render_cached, meta_path,
+                    "missing", config, cache)
+
+class TestRenderProfiles(TestCase):
+    def test_shares_decoding_and_placement(self):
+        with tempfile.TemporaryDirectory() as folder:
+            Image.new("RGB", (30, 20), (0, 0, 255)).save(
+                    os.path.join(folder, "page.png"))
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(Document("first"), Document("second"))
+            meta_path = os.path.join(folder, "page.json")
+            with open(meta_path, "w") as f:
+                json.dump(screenshot, f, cls=ScreenshotEncoder)
+            configs = [
+                Configuration(folder=folder, name="light"),
+                Configuration(folder=folder, name="dark",
+                    tooltip=Tooltip(color="000000")),
+                Configuration(folder=folder, name="large",
+                    tooltip=Tooltip(padding=20)),
+            ]
+            screenshots = [{"image": os.path.join(folder, "page.png"),
+                "metadata": meta_path}]
+
+            with mock.patch.object(webdoc.Image, "open",
+                    wraps=Image.open) as image_open, \
+                    mock.patch.object(webdoc, "place_document",
+                    wraps=webdoc.place_document) as place_document:
+                rendered = [(config.name, document.name) for config, document
+                        in render_profiles(screenshots, configs)]
+            self.assertEqual(sorted(rendered), sorted((config.name, name)
+                for config in configs for name in ("first.png", "second.png")))
+            self.assertEqual(image_open.call_count, 1)
+            # Once per document for light and dark, and once for large.
+            self.assertEqual(place_document.call_count, 4)
+
+class TestRenderPipelined(TestCase):
+    def test_matches_sequential_output(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "skald.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"folder": folder, "content_addressed": True},
+                        config_file)
+            screenshots = []
+            for name, height in (("first", 30), ("second", 30),
+                    ("page", 20)):
+                screenshot = Screenshot(name, "")
+                screenshot.add_document(Document("%s-whole" % name),
+                        Document("%s-crop" % name,
+                            crop=Rectangle(5, 5, 20, 15)))
+                # Content addressed, so first and second share one image.
+                save(screenshot, FakeWebDriver(width=40, height=height),
+                        config_path)
+                screenshots.append({
+                    "metadata": os.path.join(folder, "%s.json" % name),
+                    "image": os.path.join(folder, screenshot.image_path)})
+            self.assertEqual(screenshots[0]["image"],
+                    screenshots[1]["image"])
+
+            outputs = []
+            for prefetch in (None, 2):
+                sink = MemorySink()
+                process_screenshots(screenshots, Configuration(folder=folder,
+                    prefetch=prefetch), sink)
+                outputs.append(sink.documents)
+            self.assertEqual(len(outputs[0]), 6)
+            self.assertEqual(outputs[0], outputs[1])
+
+class TestKeepPlacement(TestCase):
+    def test_only_stores_placements_when_enabled(self):
+        with tempfile.TemporaryDirectory() as folder:
+            Image.new("RGB", (30, 20)).save(os.path.join(folder, "page.png"))
+            screenshot = Screenshot("page", "")
+            screenshot.add_document(Document("first"))
+            meta_path = os.path.join(folder, "page.json")
+            with open(meta_path, "w") as f:
+                json.dump(screenshot, f, cls=ScreenshotEncoder)
+            screenshots = [{"metadata": meta_path,
+                "image": os.path.join(folder, "page.png")}]
+
+            for keep_placement in (False, True):
+                cache_folder = os.path.join(folder, "cache%s" %
+                        keep_placement)
+                process_screenshots(screenshots, Configuration(folder=folder,
+                    cache_folder=cache_folder,
+                    keep_placement=keep_placement))
+                self.assertEqual(os.path.exists(os.path.join(cache_folder,
+                    "placements")), keep_placement)
+
+class TestRenderTooltips(TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.folder = self.temp.name
+        base = Image.linear_gradient("L").resize((200, 150)).convert("RGB")
+        base.save(os.path.join(self.folder, "page.png"))
+        self.base = base
+        screenshot = Screenshot("page", "")
+        whole = Document("whole")
+        whole.add_element(Element(location=Point(20, 20),
+            size=Size(60, 20)), tooltip="First tooltip")
+        whole.add_element(Element(location=Point(100, 90),
+            size=Size(40, 30)), tooltip="Second")
+        # Covers the second tooltip of the whole document, which must be
+        # gone after drawing it in place.
+        cropped = Document("cropped", crop=Rectangle(0, 0, 160, 140))
+        cropped.add_element(Element(location=Point(20, 20),
+            size=Size(60, 20)), tooltip="First tooltip")
+        screenshot.add_document(whole, cropped)
+        meta_path = os.path.join(self.folder, "page.json")
+        with open(meta_path, "w") as f:
+            json.dump(screenshot, f, cls=ScreenshotEncoder)
+        self.screenshots = [{"metadata": meta_path,
+            "image": os.path.join(self.folder, "page.png")}]
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def render(self, **kwargs):
+        sink = MemorySink()
+        process_screenshots(self.screenshots, Configuration(
+            folder=self.folder, **kwargs), sink)
+        return dict((name, Image.open(io.BytesIO(data)))
+                for name, data in sink.documents.items())
+
+    def test_draws_tooltips(self):
+        documents = self.render()
+        self.assertEqual(documents["whole.png"].size, (200, 150))
+        self.assertEqual(documents["cropped.png"].size, (160, 140))
+        self.assertNotEqual(documents["whole.png"].tobytes(),
+                self.base.tobytes())
+
+    def test_same_output_with_every_render_path(self):
+        expected = self.render()
+        cache_folder = os.path.join(self.folder, "cache")
+        for kwargs in ({"prefetch": 2}, {"memory_budget": 64},
+                # Twice, to also render from the cached pixels and patches.
+                {"cache_folder": cache_folder},
+                {"cache_folder": cache_folder}):
+            documents = self.render(**kwargs)
+            for name, img in expected.items():
+                self.assertEqual(documents[name].tobytes(), img.tobytes(),
+                        "%s differs with %s" % (name, kwargs))
+
+    def test_content_penalty_moves_tooltips_off_busy_content(self):
+        busy = Image.effect_noise((200, 150), 100).convert("RGB")
+        busy.paste((255, 255, 255), (100, 0, 200, 150))
+        busy.save(os.path.join(self.folder, "page.png"))
+        screenshot = Screenshot("page", "")
+        document = Document("tip")
+        document.add_element(Element(location=Point(90, 65),
+            size=Size(20, 20)), tooltip="Tip")
+        screenshot.add_document(document)
+        with open(self.screenshots[0]["metadata"], "w") as f:
+            json.dump(screenshot, f, cls=ScreenshotEncoder)
+
+        for content, left in ((0, True), (1, False)):
+            img = self.render(penalties=Penalties(content=content))["tip.png"]
+            changed = ImageChops.difference(img.convert("RGB"),
+                    busy).getbbox()
+            self.assertEqual(changed[2] <= 90, left)